@@ -0,0 +1,51 @@
+"""Shared setup of the benchmark scripts."""
+import os
+import statistics
+
+DEFAULT_ENVIRONMENT = {
+    "SECRET_KEY": "benchmark",
+    "POSTGRES_USER": "benchmark",
+    "POSTGRES_PASSWORD": "benchmark",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_DB": "benchmark",
+    "PINATA_API_KEY": "benchmark",
+    "PINATA_SECRET_API_KEY": "benchmark",
+    "PINATA_ENDPOINT": "http://localhost/pinning/pinByHash",
+    "PUBLISHER_PRIVATE_KEY": "0x" + "11" * 32,
+    "REGISTRY_CONTRACT": "0x715c754BF2019FFF238B8E4781eB2D4032408B44",
+    "INFURA_URL": "http://localhost:8545",
+    # a scratch Redis database, so queued jobs don't reach a real worker
+    "CELERY_BROKER": "redis://localhost:6379/15",
+    "CELERY_BACKEND": "redis://localhost:6379/15",
+    "BEAT_BROKER": "redis://localhost:6379/15",
+    "BEAT_BACKEND": "redis://localhost:6379/15",
+    "THEGRAPH_IPFS_ENDPOINT": "http://localhost/api/v0/add",
+}
+
+
+def configure_environment(overrides=None):
+    """Fill in the settings pan_publisher reads on import.
+
+    Must run before the first pan_publisher import. Variables already set in
+    the environment win over the defaults, ``overrides`` win over both.
+    """
+    for name, value in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ.update(overrides or {})
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles in milliseconds and throughput per second."""
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "count": len(latencies),
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+    }
@@ -0,0 +1,58 @@
+"""Generate annotations signed by throwaway Ethereum keys."""
+import json
+from datetime import datetime, timedelta
+
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+from pan_publisher.utils.ipfs import compute_cid
+from pan_publisher.utils.signature import signed_message
+
+
+class AnnotationFactory:
+    """Builds distinct, validly signed annotations.
+
+    The keys are random and never funded. Signing is the slow part, so corpus
+    seeding can ask for placeholder signatures instead.
+    """
+
+    def __init__(self, keys=4):
+        self.accounts = [Account.create() for _ in range(keys)]
+        self.start = datetime(2020, 7, 28, 16, 35, 17)
+        self.counter = 0
+
+    def make(self, signed=True):
+        index = self.counter
+        self.counter += 1
+        account = self.accounts[index % len(self.accounts)]
+        issued = self.start + timedelta(seconds=index)
+        document = {
+            "@context": ["https://pan.network/annotation/v1"],
+            "type": ["VerifiableCredential", "PANCredential"],
+            "issuer": "urn:ethereum:" + account.address,
+            "issuanceDate": issued.isoformat() + "Z",
+            "credentialSubject": {
+                "content": f"uri:tweet:benchmark/{1281904943700619265 + index}",
+                "annotation": f"annotation text {index}",
+            },
+            "proof": {
+                "type": "EthereumECDSA",
+                "created": issued.isoformat() + "Z",
+                "proofPurpose": "PANSubmission",
+                "verificationMethod": "urn:ethereum:messageHash",
+                "jws": "",
+            },
+        }
+        if signed:
+            message = encode_defunct(text=signed_message(document))
+            document["proof"]["jws"] = account.sign_message(message).signature.hex()
+        else:
+            document["proof"]["jws"] = "0x" + "00" * 65
+        return document
+
+    def make_many(self, count, signed=True):
+        return [self.make(signed=signed) for _ in range(count)]
+
+    @staticmethod
+    def cid(document):
+        return compute_cid(json.dumps(document).encode("utf-8"))
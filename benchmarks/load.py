@@ -0,0 +1,74 @@
+"""Compare concurrent-request throughput of the WSGI and the ASGI app.
+
+Usage: python benchmarks/load.py [--wsgi URL] [--asgi URL] [--path PATH]
+       [--requests N] [--concurrency C ...]
+
+Needs both apps running, e.g. through docker-compose (WSGI on port 80, ASGI
+on port 8001). Every path is requested N times per concurrency level and
+app, and the requests/s and latency percentiles are printed as JSON.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def run(base_url, path, total, concurrency):
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker(client):
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests_per_second": total / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "errors": errors,
+    }
+
+
+async def main(args):
+    results = []
+    for path in args.path:
+        for concurrency in args.concurrency:
+            for app, base_url in (("wsgi", args.wsgi), ("asgi", args.asgi)):
+                result = await run(base_url, path, args.requests, concurrency)
+                result.update(app=app, path=path, concurrency=concurrency)
+                results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--wsgi", default="http://localhost:80")
+    parser.add_argument("--asgi", default="http://localhost:8001")
+    parser.add_argument("--path", action="append")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+    args.path = args.path or ["/annotations/?limit=10"]
+    asyncio.run(main(args))
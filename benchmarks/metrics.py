@@ -0,0 +1,41 @@
+"""Measure the overhead of the stage instrumentation.
+
+Usage: python benchmarks/metrics.py [iterations]
+
+Compares an empty block with the same block timed by utils.metrics.stage and
+prints the added cost per stage in microseconds as JSON.
+"""
+import json
+import sys
+import timeit
+from contextlib import nullcontext
+
+from common import configure_environment
+
+configure_environment()
+
+from pan_publisher.utils.metrics import observe, stage  # noqa: E402
+
+
+def main(iterations):
+    def bare():
+        with nullcontext():
+            pass
+
+    def timed():
+        with stage("benchmark", "empty"):
+            pass
+
+    def observed():
+        observe("benchmark", "empty", 0.001)
+
+    results = {}
+    for name, function in (("bare", bare), ("stage", timed), ("observe", observed)):
+        best = min(timeit.repeat(function, number=iterations, repeat=5))
+        results[f"{name}_us"] = best / iterations * 1e6
+    results["stage_overhead_us"] = results["stage_us"] - results["bare_us"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
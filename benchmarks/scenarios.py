@@ -0,0 +1,241 @@
+"""The benchmark scenarios, run in-process against Postgres, Redis and stubs.
+
+Imported by suite.py once the environment points at the stubs.
+"""
+import random
+import time
+
+from falcon import testing
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from common import summarize
+from factory import AnnotationFactory
+from pan_publisher.api import background
+from pan_publisher.main import application
+from pan_publisher.model.annotation import Annotation
+from pan_publisher.model.checkpoint import SyncCheckpoint
+from pan_publisher.repository.database import engine
+
+SEED_CHUNK = 1000
+
+
+class RecordingSubmitter:
+    """Takes the place of the registry submitter, no transactions are sent."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, cid):
+        self.submitted.append(cid)
+        return "0x" + "00" * 32
+
+
+class Scenarios:
+    def __init__(self, stubs, requests, seed=0):
+        self.stubs = stubs
+        self.requests = requests
+        self.random = random.Random(seed)
+        self.client = testing.TestClient(application)
+        self.factory = AnnotationFactory()
+        self.session_factory = sessionmaker(bind=engine)
+        background.registry_submitter = RecordingSubmitter()
+
+    def reset(self):
+        with engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"TRUNCATE {Annotation.__tablename__}, "
+                    f"{SyncCheckpoint.__tablename__} CASCADE"
+                )
+            )
+        background.redis_client.delete(
+            background.BACKLOG_KEY, background.TRIGGER_KEY, background.TIMER_KEY
+        )
+        self.stubs.registry.clear()
+        self.stubs.registry_ids.clear()
+        self.stubs.registered.clear()
+
+    def seed(self, count, published=True):
+        """Insert ``count`` annotations and return their documents and CIDs.
+
+        Seeded rows carry placeholder signatures, nothing re-verifies them.
+        """
+        documents = self.factory.make_many(count, signed=False)
+        cids = [self.factory.cid(document) for document in documents]
+        session = self.session_factory()
+        try:
+            for start in range(0, count, SEED_CHUNK):
+                annotations = []
+                for document, cid in zip(
+                    documents[start : start + SEED_CHUNK],
+                    cids[start : start + SEED_CHUNK],
+                ):
+                    annotation = Annotation.from_dict(document)
+                    annotation.subject_id = cid
+                    annotation.published = published
+                    annotations.append(annotation)
+                session.bulk_save_objects(annotations)
+                session.commit()
+        finally:
+            session.close()
+        return documents, cids
+
+    @staticmethod
+    def measure(operations):
+        """Run the operations in order; each returns whether it succeeded.
+
+        Only the operations themselves are timed, not the code producing them.
+        """
+        latencies = []
+        errors = 0
+        for operation in operations:
+            start = time.perf_counter()
+            if not operation():
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        result = summarize(latencies, sum(latencies))
+        result["errors"] = errors
+        return result
+
+    def _get(self, path, params=None):
+        return lambda: self.client.simulate_get(path, params=params).status_code in (
+            200,
+            304,
+        )
+
+    def ingest(self, corpus):
+        self.seed(corpus)
+        # sign up front, signing is not part of the request cost
+        documents = self.factory.make_many(self.requests)
+
+        def post(document):
+            return lambda: (
+                self.client.simulate_post("/annotations/", json=document).status_code
+                == 200
+            )
+
+        return {"post": self.measure(post(document) for document in documents)}
+
+    def list(self, corpus):
+        documents, _ = self.seed(corpus)
+        limit = 10
+        results = {
+            "first_page": self.measure(
+                self._get("/annotations/", {"limit": limit})
+                for _ in range(self.requests)
+            ),
+            "deep_offset": self.measure(
+                self._get(
+                    "/annotations/",
+                    {"limit": limit, "offset": max(0, corpus - limit)},
+                )
+                for _ in range(self.requests)
+            ),
+        }
+
+        contents = [
+            self.random.choice(documents)["credentialSubject"]["content"]
+            for _ in range(self.requests)
+        ]
+        for mode, value in (
+            ("exact", lambda content: content),
+            ("prefix", lambda content: content[:-3]),
+            ("contains", lambda content: content[-8:-2]),
+        ):
+            results[f"filter_{mode}"] = self.measure(
+                self._get(
+                    "/annotations/",
+                    {"content": value(content), "content_mode": mode},
+                )
+                for content in contents
+            )
+
+        cursor = {"value": None}
+
+        def next_page():
+            params = {"limit": 100}
+            if cursor["value"] is not None:
+                params["cursor"] = cursor["value"]
+            response = self.client.simulate_get("/annotations/", params=params)
+            cursor["value"] = response.headers.get("X-Next-Cursor")
+            return response.status_code == 200
+
+        pages = min(self.requests, max(1, corpus // 100))
+        results["cursor_crawl"] = self.measure(next_page for _ in range(pages))
+        return results
+
+    def get(self, corpus):
+        _, cids = self.seed(corpus)
+        return {
+            "single_cid": self.measure(
+                self._get(f"/annotations/{self.random.choice(cids)}")
+                for _ in range(self.requests)
+            )
+        }
+
+    def _unpublished(self):
+        session = self.session_factory()
+        try:
+            return (
+                session.query(Annotation.id)
+                .filter(Annotation.published == False)  # noqa: E712
+                .count()
+            )
+        finally:
+            session.close()
+
+    def batch_publish(self, corpus):
+        self.seed(corpus, published=False)
+        state = {"failed": False}
+
+        def publish():
+            session = self.session_factory()
+            try:
+                cid = background._batch_publish(session, force=True)
+            finally:
+                session.rollback()
+                session.close()
+            state["failed"] = cid is None
+            return cid is not None
+
+        def batches():
+            # checked between the timed calls
+            while not state["failed"] and self._unpublished() > 0:
+                yield publish
+
+        result = self.measure(batches())
+        published = corpus - self._unpublished()
+        result["annotations_per_s"] = (
+            published / result["elapsed_s"] if result["elapsed_s"] else 0.0
+        )
+        return {"batch": result}
+
+    def sync_registry(self, corpus):
+        self.stubs.register(self.factory.make_many(corpus, signed=False))
+        latencies = []
+        sync_page = background.sync_registry_page
+
+        def timed_page(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return sync_page(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+        background.sync_registry_page = timed_page
+        started = time.perf_counter()
+        try:
+            background.sync_registry()
+        finally:
+            background.sync_registry_page = sync_page
+        result = summarize(latencies, time.perf_counter() - started)
+
+        session = self.session_factory()
+        try:
+            imported = session.query(Annotation.id).count()
+        finally:
+            session.close()
+        result["errors"] = corpus - imported
+        result["annotations_per_s"] = imported / result["elapsed_s"]
+        return {"page": result}
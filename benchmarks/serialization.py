@@ -0,0 +1,80 @@
+"""Compare the annotation list serialization paths at several page sizes.
+
+Usage: python benchmarks/serialization.py [page sizes...]
+
+Runs without a database. The entity path renders transient Annotation objects
+through to_dict() and json.dumps, like the list endpoint used to. The row path
+renders list_columns() tuples through row_to_dict() and utils.serialization.
+"""
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from common import configure_environment
+
+# the model package reads its configuration on import
+configure_environment()
+
+from pan_publisher.model.annotation import Annotation  # noqa: E402
+from pan_publisher.utils.serialization import dumps  # noqa: E402
+
+
+def make_rows(count):
+    start = datetime(2020, 7, 28, 16, 35, 17)
+    return [
+        (
+            uuid4(),
+            "0x7DaD14B10Ccf71B480883A20DD4906058a70762e",
+            start - timedelta(seconds=i),
+            f"QmZsWgikVgY3MbmgDraftxha2opsg4KSYCBeA6aGHMG{i:04d}",
+            f"uri:tweet:joaosantos/{1281904943700619265 + i}",
+            "text..",
+            start - timedelta(seconds=i),
+            "messageHash",
+            "0x" + "ab" * 65,
+            True,
+        )
+        for i in range(count)
+    ]
+
+
+def make_entities(rows):
+    columns = [column.key for column in Annotation.list_columns()]
+    return [Annotation(**dict(zip(columns, row))) for row in rows]
+
+
+def entity_path(entities):
+    return json.dumps([a.to_dict() for a in entities]).encode("utf-8")
+
+
+def row_path(rows):
+    return dumps([Annotation.row_to_dict(row) for row in rows])
+
+
+def main(page_sizes):
+    results = []
+    for size in page_sizes:
+        rows = make_rows(size)
+        entities = make_entities(rows)
+        assert json.loads(entity_path(entities)) == json.loads(row_path(rows))
+
+        number = max(1, 20_000 // size)
+        entity_time = min(
+            timeit.repeat(lambda: entity_path(entities), number=number, repeat=5)
+        )
+        row_time = min(timeit.repeat(lambda: row_path(rows), number=number, repeat=5))
+        results.append(
+            {
+                "page_size": size,
+                "entity_ms": entity_time / number * 1000,
+                "row_ms": row_time / number * 1000,
+                "speedup": entity_time / row_time,
+            }
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10, 100, 1000])
@@ -0,0 +1,145 @@
+"""Local stand-ins for TheGraph IPFS, the IPFS gateway, Pinata and the subgraph.
+
+All endpoints are served by one threaded HTTP server on localhost:
+
+- ``POST /api/v0/add`` stores the uploaded file and answers its CID
+- ``GET /api/v0/cat?arg=<cid>`` answers a stored document
+- ``POST /pinning/pinByHash`` accepts every pin
+- ``POST /subgraph`` answers the cid_in and id_gt annotation queries
+
+An optional fixed latency is added to every response to emulate remote
+dependencies.
+"""
+import bisect
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# no configuration involved, so this is safe to import before the environment
+from pan_publisher.utils.ipfs import compute_cid
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _reply(self, status, payload):
+        time.sleep(self.server.stubs.latency)
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/v0/cat":
+            self._cat(url)
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path == "/api/v0/add":
+            self._add(body)
+        elif url.path == "/api/v0/cat":
+            self._cat(url)
+        elif url.path == "/pinning/pinByHash":
+            self._reply(200, {"status": "pinned"})
+        elif url.path == "/subgraph":
+            self._subgraph(json.loads(body))
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def _add(self, body):
+        # the single file part of the multipart upload
+        boundary = re.search(r"boundary=(\S+)", self.headers["Content-Type"])
+        delimiter = b"--" + boundary.group(1).encode()
+        part = body.split(delimiter)[1]
+        content = part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+        cid = self.server.stubs.add(content)
+        self._reply(200, {"Name": "batch.json", "Hash": cid, "Size": len(content)})
+
+    def _cat(self, url):
+        cid = parse_qs(url.query).get("arg", [""])[0]
+        content = self.server.stubs.documents.get(cid)
+        if content is None:
+            self._reply(500, {"Message": "not found"})
+        else:
+            self._reply(200, content)
+
+    def _subgraph(self, request):
+        query = request["query"]
+        variables = request.get("variables", {})
+        stubs = self.server.stubs
+        if "cid_in" in query:
+            annotations = [
+                stubs.registry[stubs.registered[cid]]
+                for cid in variables.get("cids", [])
+                if cid in stubs.registered
+            ]
+        elif "id_gt" in query:
+            start = bisect.bisect_right(stubs.registry_ids, variables.get("last", ""))
+            annotations = stubs.registry[start : start + variables.get("first", 100)]
+        else:
+            annotations = []
+        self._reply(200, {"data": {"annotations": annotations}})
+
+
+class StubServers:
+    def __init__(self, latency=0.0, port=0):
+        self.latency = latency
+        self.documents = {}
+        # sorted by id, like the subgraph's orderBy: id
+        self.registry = []
+        self.registry_ids = []
+        self.registered = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.daemon_threads = True
+        self.server.stubs = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def environment(self):
+        """The pan_publisher settings that point at these stubs."""
+        return {
+            "THEGRAPH_IPFS_ENDPOINT": self.url + "/api/v0/add",
+            "IPFS_GATEWAY_ENDPOINT": self.url + "/api/v0/cat",
+            "PINATA_ENDPOINT": self.url + "/pinning/pinByHash",
+            "PAN_SUBGRAPH": self.url + "/subgraph",
+        }
+
+    def add(self, content):
+        cid = compute_cid(content)
+        self.documents[cid] = content
+        return cid
+
+    def register(self, documents):
+        """Publish documents on the stub IPFS and list them in the registry."""
+        for document in documents:
+            cid = self.add(json.dumps(document).encode("utf-8"))
+            entry_id = f"{len(self.registry):012d}"
+            self.registered[cid] = len(self.registry)
+            self.registry.append({"id": entry_id, "cid": cid, "batchCID": None})
+            self.registry_ids.append(entry_id)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
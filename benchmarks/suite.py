@@ -0,0 +1,103 @@
+"""Latency and throughput benchmarks of the publisher API and workers.
+
+Usage: python benchmarks/suite.py --reset-db [--scenario NAME ...]
+       [--corpus N ...] [--requests N] [--stub-latency MS] [--output FILE]
+
+Needs Postgres and Redis, e.g. ``docker-compose up -d postgres redis`` with
+the POSTGRES_* variables of your .env. Every scenario TRUNCATEs the annotation
+tables of that database first, so point it at a scratch database; --reset-db
+confirms that you did. TheGraph IPFS, the IPFS gateway, Pinata and the
+subgraph are served by local stubs (stubs.py). No registry transactions are
+sent, batch_publish hands its CIDs to a recorder instead.
+
+Scenarios, each run once per corpus size:
+
+- ingest: POST /annotations/ with freshly signed annotations
+- list: first page, deep offset, cursor crawl and content filters
+- get: GET /annotations/{cid} of random stored annotations
+- batch_publish: drain a backlog of unpublished annotations batch by batch
+- sync_registry: import a registry of the corpus size from the stub subgraph
+
+The results - p50/p95/p99 latency, throughput and error counts per scenario
+variant - are written as JSON so that runs can be compared.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from common import configure_environment
+from stubs import StubServers
+
+SCENARIO_NAMES = ("ingest", "list", "get", "batch_publish", "sync_registry")
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args):
+    stubs = StubServers(latency=args.stub_latency / 1000).start()
+    configure_environment(stubs.environment())
+
+    # pan_publisher reads its configuration on import
+    from scenarios import Scenarios
+
+    scenarios = Scenarios(stubs, requests=args.requests)
+    results = []
+    try:
+        for name in args.scenario:
+            for corpus in args.corpus:
+                print(f"Running {name} on a corpus of {corpus}", file=sys.stderr)
+                scenarios.reset()
+                for variant, result in getattr(scenarios, name)(corpus).items():
+                    result.update(scenario=name, variant=variant, corpus=corpus)
+                    results.append(result)
+    finally:
+        stubs.stop()
+
+    report = {
+        "started": args.started,
+        "revision": git_revision(),
+        "settings": {
+            "requests": args.requests,
+            "stub_latency_ms": args.stub_latency,
+            "batch_format": os.environ.get("BATCH_FORMAT", "v1"),
+            "ipfs_publish_mode": os.environ.get("IPFS_PUBLISH_MODE", "sync"),
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--reset-db",
+        action="store_true",
+        help="confirm that the configured database may be truncated",
+    )
+    parser.add_argument(
+        "--scenario", nargs="+", choices=SCENARIO_NAMES, default=SCENARIO_NAMES
+    )
+    parser.add_argument("--corpus", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--stub-latency", type=float, default=0.0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    if not args.reset_db:
+        parser.error("the scenarios truncate the database, pass --reset-db")
+    args.started = datetime.now(timezone.utc).isoformat()
+    main(args)
@@ -1,2 +1,8 @@
-from .annotations import AnnotationResource
+from .annotations import (
+    AnnotationBulkResource,
+    AnnotationExportResource,
+    AnnotationProofResource,
+    AnnotationResource,
+)
+from .metrics import MetricsResource
 from .users import LoginResource, LogoutResource, UserResource
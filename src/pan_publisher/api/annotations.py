@@ -1,25 +1,34 @@
 import json
-from copy import deepcopy
 
+import dateutil.parser
 import falcon
-import requests
-from eth_account import Account
-from eth_account.messages import encode_defunct
-from eth_utils import remove_0x_prefix
-from falcon.media.validators import jsonschema
+from jsonschema import Draft4Validator, FormatChecker, ValidationError
 from loguru import logger
 from requests.exceptions import ConnectionError, ReadTimeout
 from sqlalchemy.orm import Session
 
-from pan_publisher.api.background import batch_publish
+from pan_publisher.api.background import queue_uploads, trigger_batch
 from pan_publisher.config import (
+    BULK_MAX_ITEMS,
+    IPFS_PUBLISH_MODE,
     PINATA_API_KEY,
     PINATA_ENDPOINT,
     PINATA_SECRET_API_KEY,
     THEGRAPH_IPFS_ENDPOINT,
 )
+from pan_publisher.middleware.session import after_commit
 from pan_publisher.model.annotation import Annotation
-from pan_publisher.repository.annotations import AnnotationsRepository
+from pan_publisher.repository.annotations import (
+    CONTENT_FILTER_MODES,
+    EXPORT_SINCE_FIELDS,
+    AnnotationsRepository,
+)
+from pan_publisher.repository.cache import response_cache
+from pan_publisher.utils.http import http_session, http_timeout
+from pan_publisher.utils.ipfs import compute_cid
+from pan_publisher.utils.metrics import stage
+from pan_publisher.utils.serialization import dumps
+from pan_publisher.utils.signature import recover_issuer, recover_issuers
 
 # TODO: Move to config
 ANNOTATION_SCHEMA = {
@@ -67,46 +76,249 @@ ANNOTATION_SCHEMA = {
 }
 
 
+class AnnotationBulkResource:
+    validator = Draft4Validator(ANNOTATION_SCHEMA)
+
+    def __init__(self, annotation_repository: AnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    @staticmethod
+    def _parse(req: falcon.Request):
+        if req.content_type and "application/x-ndjson" in req.content_type:
+            items = []
+            for line in req.bounded_stream.read().decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError:
+                    items.append(None)
+            return items
+
+        if not isinstance(req.media, list):
+            raise falcon.HTTPBadRequest(description="Expected an array of annotations")
+        return req.media
+
+    def on_post(self, req: falcon.Request, res: falcon.Response):
+        items = self._parse(req)
+        logger.debug(f"Received bulk submission of {len(items)} annotations")
+        if len(items) > BULK_MAX_ITEMS:
+            raise falcon.HTTPPayloadTooLarge(
+                description=f"At most {BULK_MAX_ITEMS} annotations per request"
+            )
+
+        results = [{"index": index} for index in range(len(items))]
+        valid = []
+        for index, item in enumerate(items):
+            if item is None or not self.validator.is_valid(item):
+                results[index]["error"] = "Invalid annotation"
+            else:
+                valid.append(index)
+
+        # stored content short-circuits to its existing CID
+        content_hashes = {
+            index: Annotation.hash_content(items[index]) for index in valid
+        }
+        known = self.annotation_repository.known_content_hashes(
+            list(set(content_hashes.values()))
+        )
+        candidates = []
+        for index in valid:
+            if content_hashes[index] in known:
+                results[index]["ipfsHash"] = known[content_hashes[index]]
+                results[index]["duplicate"] = True
+            else:
+                candidates.append(index)
+
+        issuers = recover_issuers([items[index] for index in candidates])
+        verified = []
+        for index, signature_issuer in zip(candidates, issuers):
+            # parsed like Annotation.from_dict does
+            issuer_parts = items[index]["issuer"].split(":")
+            if len(issuer_parts) < 3:
+                results[index]["error"] = "Invalid issuer"
+                continue
+            request_issuer = issuer_parts[2]
+            if signature_issuer is None or (
+                request_issuer.lower() != signature_issuer.lower()
+            ):
+                results[index]["error"] = "Bad signature issuer"
+                continue
+            payload = json.dumps(items[index])
+            results[index]["ipfsHash"] = compute_cid(payload.encode("utf-8"))
+            verified.append((index, payload))
+
+        # catch remaining duplicates up front so they can't fail the whole
+        # transaction
+        known_cids = self.annotation_repository.known_cids(
+            [results[index]["ipfsHash"] for index, _ in verified]
+        )
+        seen = set()
+        session: Session = req.context["session"]
+        accepted = []
+        for index, payload in verified:
+            ipfs_hash = results[index]["ipfsHash"]
+            if ipfs_hash in known_cids or content_hashes[index] in seen:
+                results[index]["duplicate"] = True
+                continue
+            try:
+                annotation = Annotation.from_dict(items[index])
+            except (OverflowError, ValueError) as e:
+                # e.g. a validly signed but unparsable date
+                results[index]["error"] = f"Invalid annotation: {e}"
+                continue
+            oversized = annotation.oversized_columns()
+            if oversized:
+                results[index]["error"] = f"Too long: {', '.join(oversized)}"
+                continue
+            seen.add(content_hashes[index])
+            annotation.subject_id = ipfs_hash
+            annotation.pending_payload = payload
+            session.add(annotation)
+            accepted.append((payload, ipfs_hash))
+
+        # all accepted rows are committed together by the session middleware,
+        # the IPFS uploads are queued once they are
+        if accepted:
+            after_commit(req, queue_uploads, accepted)
+
+        res.body = json.dumps(
+            {
+                "accepted": len(accepted),
+                "rejected": len(items) - len(accepted),
+                "results": results,
+            }
+        )
+
+
+class AnnotationExportResource:
+    def __init__(self, annotation_repository: AnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    def on_get(self, req: falcon.Request, res: falcon.Response):
+        since = req.get_param("since", default=None)
+        if since is not None:
+            try:
+                since = dateutil.parser.parse(since)
+            except (ValueError, OverflowError):
+                raise falcon.HTTPBadRequest(description="since must be a date")
+        since_field = req.get_param("since_field", default="issuance")
+        if since_field not in EXPORT_SINCE_FIELDS:
+            raise falcon.HTTPBadRequest(
+                description="since_field must be one of "
+                + ", ".join(EXPORT_SINCE_FIELDS)
+            )
+        published = req.get_param_as_bool("published")
+
+        logger.debug(f"Exporting annotations since {since} ({since_field})")
+        res.content_type = "application/x-ndjson"
+        res.stream = self.annotation_repository.export(
+            since=since, since_field=since_field, published=published
+        )
+
+
+class AnnotationProofResource:
+    def __init__(self, annotation_repository: AnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    def on_get(self, req: falcon.Request, res: falcon.Response, annotation_id):
+        logger.debug(f"Fetching batch inclusion proof of {annotation_id}")
+        output = self.annotation_repository.get_proof(annotation_id=annotation_id)
+        if output is None:
+            res.status = falcon.HTTP_NOT_FOUND
+            return
+        res.body = json.dumps(output)
+
+
 class AnnotationResource:
+    validator = Draft4Validator(ANNOTATION_SCHEMA, format_checker=FormatChecker())
+
     def __init__(self, annotation_repository: AnnotationsRepository):
         self.annotation_repository = annotation_repository
 
     def on_get(self, req: falcon.Request, res: falcon.Response, annotation_id=None):
+        if annotation_id:
+            self._get_single(req, res, annotation_id)
+            return
+
         content_filter = req.get_param("content", default=None)
+        content_mode = req.get_param("content_mode", default="contains")
+        if content_mode not in CONTENT_FILTER_MODES:
+            raise falcon.HTTPBadRequest(
+                description="content_mode must be one of "
+                + ", ".join(CONTENT_FILTER_MODES)
+            )
         limit = req.context["pagination"]["limit"]
         offset = req.context["pagination"]["offset"]
+        cursor = req.context["pagination"]["cursor"]
 
-        if annotation_id:
+        logger.debug("Fetching annotation list")
+        output, next_cursor = self.annotation_repository.list(
+            filter_value=content_filter,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            filter_mode=content_mode,
+        )
+        if next_cursor is not None:
+            res.set_header("X-Next-Cursor", next_cursor)
+
+        res.data = dumps(output)
+        if len(output) == 0:
+            res.status = falcon.HTTP_NOT_FOUND
+
+    @staticmethod
+    def _cache_headers(res: falcon.Response, entry):
+        res.etag = entry.etag
+        if entry.published:
+            # published annotations are content-addressed and never change
+            res.cache_control = ["public", "max-age=31536000", "immutable"]
+        else:
+            res.cache_control = ["no-cache"]
+
+    def _get_single(self, req: falcon.Request, res: falcon.Response, annotation_id):
+        entry = response_cache.get(annotation_id)
+        if entry is None:
             logger.debug("Fetching data by annotation ID")
             output = self.annotation_repository.get_by_cid(annotation_id=annotation_id)
-        else:
-            logger.debug("Fetching annotation list")
-            output = self.annotation_repository.list(
-                filter_value=content_filter, offset=offset, limit=limit,
+            if len(output) == 0:
+                res.body = json.dumps(output)
+                res.status = falcon.HTTP_NOT_FOUND
+                return
+            entry = response_cache.set(
+                annotation_id,
+                json.dumps(output).encode("utf-8"),
+                published=bool(output[0]["published"]),
             )
 
-        res.body = json.dumps(output)
-        if len(output) == 0:
-            res.status = falcon.HTTP_NOT_FOUND
+        self._cache_headers(res, entry)
+        if req.if_none_match and any(
+            tag == "*" or tag == entry.etag for tag in req.if_none_match
+        ):
+            res.status = falcon.HTTP_NOT_MODIFIED
+            return
+        res.data = entry.body
 
-    @jsonschema.validate(req_schema=ANNOTATION_SCHEMA)
     def on_post(self, req: falcon.Request, res: falcon.Response, annotation_id=None):
+        with stage("submit", "validation"):
+            try:
+                self.validator.validate(req.media)
+            except ValidationError as e:
+                raise falcon.HTTPBadRequest(
+                    "Request data failed validation", description=e.message
+                )
         logger.debug(f"Received annotation {req.media}")
-        message = deepcopy(req.media)
-        del message["proof"]["jws"]
-        encoded_message = json.dumps(message, separators=(",", ":"))
-        signed_message = encode_defunct(text=encoded_message)
+        # resubmissions of stored content are answered before any further work
+        content_hash = Annotation.hash_content(req.media)
+        known = self.annotation_repository.known_content_hashes([content_hash])
+        if content_hash in known:
+            logger.debug(f"Annotation already stored as {known[content_hash]}")
+            res.body = json.dumps({"ipfsHash": known[content_hash]})
+            return
 
-        raw_signature = remove_0x_prefix(req.media["proof"]["jws"])
         request_issuer = req.media["issuer"].split(":")[2]
-        signature_issuer = Account.recover_message(
-            signable_message=signed_message,
-            vrs=(
-                int(raw_signature[128:130], 16),  # 0x1c or bust
-                int(raw_signature[0:64], 16),
-                int(raw_signature[64:128], 16),
-            ),
-        )
+        with stage("submit", "signature"):
+            signature_issuer = recover_issuer(req.media)
 
         if request_issuer.lower() != signature_issuer.lower():
             logger.debug(
@@ -120,14 +332,29 @@ class AnnotationResource:
         session: Session = req.context["session"]
         session.add(annotation)
 
+        payload = json.dumps(req.media)
+        if IPFS_PUBLISH_MODE == "deferred":
+            # the CID is derived from the content, so we can answer right away
+            # and leave the upload and pinning to the background workers
+            with stage("submit", "cid"):
+                ipfs_hash = compute_cid(payload.encode("utf-8"))
+            annotation.subject_id = ipfs_hash
+            # kept on the row until the upload succeeds, so it can't get lost
+            annotation.pending_payload = payload
+            res.body = json.dumps({"ipfsHash": ipfs_hash})
+            logger.debug(f"Deferring IPFS publication of annotation {ipfs_hash}")
+            after_commit(req, queue_uploads, [(payload, ipfs_hash)])
+            return
+
         # publish annotation on IPFS and add subject ID
         logger.debug("Adding and pinning annotation on TheGraph")
         try:
-            response = requests.post(
-                THEGRAPH_IPFS_ENDPOINT,
-                files={"batch.json": json.dumps(req.media).encode("utf-8")},
-                timeout=5,
-            )
+            with stage("submit", "ipfs_add"):
+                response = http_session("thegraph").post(
+                    THEGRAPH_IPFS_ENDPOINT,
+                    files={"batch.json": payload.encode("utf-8")},
+                    timeout=http_timeout("thegraph"),
+                )
         except (ConnectionError, ReadTimeout) as e:
             logger.error(f"Connection to TheGraph timed out: {e}")
             res.status = falcon.HTTP_FAILED_DEPENDENCY
@@ -152,15 +379,16 @@ class AnnotationResource:
 
         logger.debug("Pinning annotation to Pinata")
         try:
-            response = requests.post(
-                PINATA_ENDPOINT,
-                headers={
-                    "pinata_api_key": PINATA_API_KEY,
-                    "pinata_secret_api_key": PINATA_SECRET_API_KEY,
-                },
-                json={"hashToPin": ipfs_hash},
-                timeout=5,
-            )
+            with stage("submit", "pinata_pin"):
+                response = http_session("pinata").post(
+                    PINATA_ENDPOINT,
+                    headers={
+                        "pinata_api_key": PINATA_API_KEY,
+                        "pinata_secret_api_key": PINATA_SECRET_API_KEY,
+                    },
+                    json={"hashToPin": ipfs_hash},
+                    timeout=http_timeout("pinata"),
+                )
         except (ConnectionError, ReadTimeout) as e:
             # continue from here because Pinata is not a required dependency
             logger.error(f"Connection to Pinata timed out: {e}")
@@ -171,5 +399,5 @@ class AnnotationResource:
         res.body = json.dumps({"ipfsHash": ipfs_hash})
 
         # check whether we should publish a new batch
-        logger.debug("Running batch check background job")
-        batch_publish.delay()
+        logger.debug("Triggering batch check background job")
+        after_commit(req, trigger_batch)
@@ -0,0 +1,237 @@
+import asyncio
+import json
+
+import dateutil.parser
+import falcon
+import httpx
+from jsonschema import Draft4Validator
+from loguru import logger
+
+from pan_publisher.api.annotations import ANNOTATION_SCHEMA, AnnotationResource
+from pan_publisher.api.background import queue_uploads, trigger_batch
+from pan_publisher.config import (
+    IPFS_PUBLISH_MODE,
+    PINATA_API_KEY,
+    PINATA_ENDPOINT,
+    PINATA_SECRET_API_KEY,
+    THEGRAPH_IPFS_ENDPOINT,
+)
+from pan_publisher.middleware.session import after_commit
+from pan_publisher.model.annotation import Annotation
+from pan_publisher.repository.annotations import (
+    CONTENT_FILTER_MODES,
+    EXPORT_SINCE_FIELDS,
+    AsyncAnnotationsRepository,
+)
+from pan_publisher.repository.cache import response_cache
+from pan_publisher.utils.http import async_http_client
+from pan_publisher.utils.ipfs import compute_cid
+from pan_publisher.utils.serialization import dumps
+from pan_publisher.utils.signature import recover_issuer
+
+
+async def _run_blocking(func, *args):
+    # signature recovery and the Redis client are synchronous; neither may
+    # stall the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+class AsyncAnnotationExportResource:
+    def __init__(self, annotation_repository: AsyncAnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    async def on_get(self, req: falcon.Request, res: falcon.Response):
+        since = req.get_param("since", default=None)
+        if since is not None:
+            try:
+                since = dateutil.parser.parse(since)
+            except (ValueError, OverflowError):
+                raise falcon.HTTPBadRequest(description="since must be a date")
+        since_field = req.get_param("since_field", default="issuance")
+        if since_field not in EXPORT_SINCE_FIELDS:
+            raise falcon.HTTPBadRequest(
+                description="since_field must be one of "
+                + ", ".join(EXPORT_SINCE_FIELDS)
+            )
+        published = req.get_param_as_bool("published")
+
+        logger.debug(f"Exporting annotations since {since} ({since_field})")
+        res.content_type = "application/x-ndjson"
+        res.stream = self.annotation_repository.export(
+            since=since, since_field=since_field, published=published
+        )
+
+
+class AsyncAnnotationProofResource:
+    def __init__(self, annotation_repository: AsyncAnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    async def on_get(self, req: falcon.Request, res: falcon.Response, annotation_id):
+        logger.debug(f"Fetching batch inclusion proof of {annotation_id}")
+        output = await self.annotation_repository.get_proof(
+            annotation_id=annotation_id
+        )
+        if output is None:
+            res.status = falcon.HTTP_NOT_FOUND
+            return
+        res.body = json.dumps(output)
+
+
+class AsyncAnnotationResource:
+    validator = Draft4Validator(ANNOTATION_SCHEMA)
+
+    def __init__(self, annotation_repository: AsyncAnnotationsRepository):
+        self.annotation_repository = annotation_repository
+
+    async def on_get(
+        self, req: falcon.Request, res: falcon.Response, annotation_id=None
+    ):
+        if annotation_id:
+            await self._get_single(req, res, annotation_id)
+            return
+
+        content_filter = req.get_param("content", default=None)
+        content_mode = req.get_param("content_mode", default="contains")
+        if content_mode not in CONTENT_FILTER_MODES:
+            raise falcon.HTTPBadRequest(
+                description="content_mode must be one of "
+                + ", ".join(CONTENT_FILTER_MODES)
+            )
+        limit = req.context["pagination"]["limit"]
+        offset = req.context["pagination"]["offset"]
+        cursor = req.context["pagination"]["cursor"]
+
+        logger.debug("Fetching annotation list")
+        output, next_cursor = await self.annotation_repository.list(
+            filter_value=content_filter,
+            offset=offset,
+            limit=limit,
+            cursor=cursor,
+            filter_mode=content_mode,
+        )
+        if next_cursor is not None:
+            res.set_header("X-Next-Cursor", next_cursor)
+
+        res.data = dumps(output)
+        if len(output) == 0:
+            res.status = falcon.HTTP_NOT_FOUND
+
+    async def _get_single(
+        self, req: falcon.Request, res: falcon.Response, annotation_id
+    ):
+        entry = await _run_blocking(response_cache.get, annotation_id)
+        if entry is None:
+            logger.debug("Fetching data by annotation ID")
+            output = await self.annotation_repository.get_by_cid(
+                annotation_id=annotation_id
+            )
+            if len(output) == 0:
+                res.body = json.dumps(output)
+                res.status = falcon.HTTP_NOT_FOUND
+                return
+            entry = await _run_blocking(
+                response_cache.set,
+                annotation_id,
+                json.dumps(output).encode("utf-8"),
+                bool(output[0]["published"]),
+            )
+
+        AnnotationResource._cache_headers(res, entry)
+        if req.if_none_match and any(
+            tag == "*" or tag == entry.etag for tag in req.if_none_match
+        ):
+            res.status = falcon.HTTP_NOT_MODIFIED
+            return
+        res.data = entry.body
+
+    async def on_post(
+        self, req: falcon.Request, res: falcon.Response, annotation_id=None
+    ):
+        media = await req.get_media()
+        if not self.validator.is_valid(media):
+            raise falcon.HTTPBadRequest(description="Invalid annotation")
+        logger.debug(f"Received annotation {media}")
+
+        # resubmissions of stored content are answered before any further work
+        content_hash = Annotation.hash_content(media)
+        known = await self.annotation_repository.known_content_hashes([content_hash])
+        if content_hash in known:
+            logger.debug(f"Annotation already stored as {known[content_hash]}")
+            res.body = json.dumps({"ipfsHash": known[content_hash]})
+            return
+
+        request_issuer = media["issuer"].split(":")[2]
+        signature_issuer = await _run_blocking(recover_issuer, media)
+
+        if request_issuer.lower() != signature_issuer.lower():
+            logger.debug(
+                f"Bad signature issuer: {request_issuer} != {signature_issuer}"
+            )
+            res.status = falcon.HTTP_BAD_REQUEST
+            return
+
+        annotation = Annotation.from_dict(media)
+        session = req.context["session"]
+        session.add(annotation)
+
+        payload = json.dumps(media)
+        if IPFS_PUBLISH_MODE == "deferred":
+            ipfs_hash = compute_cid(payload.encode("utf-8"))
+            annotation.subject_id = ipfs_hash
+            annotation.pending_payload = payload
+            res.body = json.dumps({"ipfsHash": ipfs_hash})
+            logger.debug(f"Deferring IPFS publication of annotation {ipfs_hash}")
+            after_commit(req, queue_uploads, [(payload, ipfs_hash)])
+            return
+
+        logger.debug("Adding and pinning annotation on TheGraph")
+        try:
+            response = await async_http_client("thegraph").post(
+                THEGRAPH_IPFS_ENDPOINT,
+                files={"batch.json": payload.encode("utf-8")},
+            )
+        except httpx.TransportError as e:
+            logger.error(f"Connection to TheGraph timed out: {e}")
+            res.status = falcon.HTTP_FAILED_DEPENDENCY
+            return
+
+        if response.status_code != 200:
+            logger.error(
+                f"Publishing to TheGraph failed with response '{response.text}'"
+            )
+            res.status = falcon.HTTP_FAILED_DEPENDENCY
+            return
+
+        try:
+            ipfs_hash = response.json()["Hash"]
+        except (json.JSONDecodeError, KeyError):
+            logger.error(
+                f"TheGraph returned an invalid JSON response: '{response.text}'"
+            )
+            res.status = falcon.HTTP_FAILED_DEPENDENCY
+            return
+        annotation.subject_id = ipfs_hash
+
+        logger.debug("Pinning annotation to Pinata")
+        try:
+            response = await async_http_client("pinata").post(
+                PINATA_ENDPOINT,
+                headers={
+                    "pinata_api_key": PINATA_API_KEY,
+                    "pinata_secret_api_key": PINATA_SECRET_API_KEY,
+                },
+                json={"hashToPin": ipfs_hash},
+            )
+        except httpx.TransportError as e:
+            # continue from here because Pinata is not a required dependency
+            logger.error(f"Connection to Pinata timed out: {e}")
+        else:
+            if response.status_code != 200:
+                logger.error(
+                    f"Pinning on Pinata failed with response '{response.text}'"
+                )
+
+        res.body = json.dumps({"ipfsHash": ipfs_hash})
+
+        logger.debug("Triggering batch check background job")
+        after_commit(req, trigger_batch)
@@ -1,65 +1,243 @@
 import json
 import time
+from collections import defaultdict
 from datetime import datetime, timedelta
 from uuid import uuid4
 
 import celery
-import dateutil.parser
-import requests
-import web3
-from aiohttp.client_exceptions import ClientConnectionError
+import redis
+from celery.signals import task_postrun, task_prerun, worker_process_init
 from eth_account.account import SignedMessage
 from eth_account.messages import encode_defunct
-from gql import AIOHTTPTransport, Client, gql
+from gql import gql
 from loguru import logger
+from prometheus_client import start_http_server
+from requests.exceptions import ConnectionError, ReadTimeout
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Query, Session, sessionmaker
-from sqlalchemy.orm.exc import MultipleResultsFound
+from sqlalchemy.orm import Session, sessionmaker
 
 from pan_publisher.config import (
+    BATCH_FORMAT,
+    BATCH_MAX_BYTES,
+    BATCH_MAX_LATENCY,
+    BATCH_MAX_SIZE,
     BATCH_SIZE,
+    BATCH_TRIGGER_REDIS,
     CELERY_BACKEND,
     CELERY_BROKER,
-    INFURA_URL,
-    PAN_SUBGRAPH,
+    IPFS_PUBLISH_RETRIES,
+    IPFS_PUBLISH_SWEEP_AGE,
+    METRICS_WORKER_PORT,
     PINATA_API_KEY,
     PINATA_ENDPOINT,
     PINATA_SECRET_API_KEY,
     PUBLISHER_ACCOUNT,
     PUBLISHER_PUBKEY,
-    REGISTRY_ABI,
-    REGISTRY_CONTRACT,
+    REGISTRY_CONFIRM_INTERVAL,
+    REGISTRY_SYNC_MODE,
     THEGRAPH_IPFS_ENDPOINT,
+    TRUSTED_PUBLISHERS,
 )
 from pan_publisher.model.annotation import Annotation
+from pan_publisher.model.checkpoint import SyncCheckpoint
 from pan_publisher.repository.annotations import AnnotationsRepository
+from pan_publisher.repository.cache import document_cache, response_cache
 from pan_publisher.repository.database import engine
+from pan_publisher.repository.registry import RegistrySubmitter
+from pan_publisher.repository.subgraph import SubgraphError, subgraph_client
+from pan_publisher.utils.http import http_session, http_stats, http_timeout
+from pan_publisher.utils.merkle import merkle_proof, merkle_root, merkle_tree
+from pan_publisher.utils.metrics import (
+    RuntimeCollector,
+    metrics_registry,
+    observe,
+    stage,
+)
+from pan_publisher.utils.profiling import sampler
+from pan_publisher.utils.signature import recover_batch_issuer, signature_cache
 
 app = celery.Celery("tasks", broker=CELERY_BROKER, backend=CELERY_BACKEND)
+REGISTRY_CHECKPOINT = "registry"
+redis_client = redis.Redis.from_url(BATCH_TRIGGER_REDIS)
+registry_submitter = RegistrySubmitter(redis_client)
+
+BACKLOG_KEY = "pan:batch:backlog"
+TRIGGER_KEY = "pan:batch:triggered"
+TIMER_KEY = "pan:batch:timer"
+
+# running task profiles by task ID
+_task_profiles = {}
+
+
+def _batchable():
+    # deferred submissions join a batch only once their document is on IPFS
+    return (
+        Annotation.published == False,
+        Annotation.batch_id == None,
+        Annotation.pending_payload == None,
+    )
+
+
+def claim_unpublished(session):
+    # lock a bounded set of unbatched rows in one statement - rows locked by a
+    # concurrent run are skipped instead of waited on
+    annotations = (
+        session.query(Annotation)
+        .filter(*_batchable())
+        .order_by(Annotation.created)
+        .limit(BATCH_MAX_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    if BATCH_FORMAT == "v2":
+        # the signed payload is constant-size, only the row count matters
+        return annotations
+
+    # cap the batch document size: each CID is a quoted, comma-separated entry
+    claimed = []
+    batch_bytes = 0
+    for annotation in annotations:
+        batch_bytes += len(annotation.subject_id) + 3
+        if claimed and batch_bytes > BATCH_MAX_BYTES:
+            break
+        claimed.append(annotation)
+    return claimed
+
+
+def _arm_timer():
+    if redis_client.set(TIMER_KEY, 1, nx=True, ex=BATCH_MAX_LATENCY + 60):
+        batch_publish.apply_async(kwargs={"force": True}, countdown=BATCH_MAX_LATENCY)
+
+
+def _schedule_batch(backlog):
+    if backlog >= BATCH_SIZE:
+        # at most one batch job waits in the queue at any time
+        if redis_client.set(TRIGGER_KEY, 1, nx=True, ex=BATCH_MAX_LATENCY):
+            batch_publish.delay()
+    elif backlog > 0:
+        # the first submission of a window arms the max-latency timer
+        _arm_timer()
+
+
+def trigger_batch(count=1):
+    """Record new submissions and coalesce them into a pending batch job."""
+    try:
+        _schedule_batch(redis_client.incrby(BACKLOG_KEY, count))
+    except redis.RedisError as e:
+        logger.error(f"Failed to trigger batch publication: {e}")
 
 
 @app.task
-def batch_publish():
+def batch_publish(force=False):
+    # submissions from here on count towards the next batch
+    redis_client.delete(TRIGGER_KEY)
+    redis_client.set(BACKLOG_KEY, 0)
+    if force:
+        redis_client.delete(TIMER_KEY)
+
     session: Session = sessionmaker(bind=engine)()
-    # get all annotations from the DB that aren't published yet
-    annotations: Query = session.query(Annotation).filter(Annotation.published == False)
-    logger.info(f"Got {annotations.count()} unpublished annotations")
-    if annotations.count() < BATCH_SIZE:
+    ipfs_hash = None
+    try:
+        ipfs_hash = _batch_publish(session, force=force)
+        return ipfs_hash
+    finally:
+        # also releases the row locks if we bailed out before committing
+        session.rollback()
+        backlog = (
+            session.query(Annotation.id)
+            .filter(*_batchable())
+            .limit(BATCH_SIZE)
+            .count()
+        )
+        session.close()
+        # re-arm for rows that didn't fit or failed to publish
+        redis_client.incrby(BACKLOG_KEY, backlog)
+        if ipfs_hash is None and backlog >= BATCH_SIZE:
+            # a full batch failed to publish - the trigger key holds off
+            # size-triggered jobs, so the max-latency timer retries instead
+            # of a failing job per submission
+            redis_client.set(TRIGGER_KEY, 1, ex=BATCH_MAX_LATENCY)
+            _arm_timer()
+        else:
+            _schedule_batch(backlog)
+
+
+def _ipfs_add(document):
+    """Add and pin a JSON document on TheGraph and Pinata; returns its CID."""
+    with stage("batch", "ipfs_add"):
+        response = http_session("thegraph").post(
+            THEGRAPH_IPFS_ENDPOINT,
+            files={"batch.json": json.dumps(document).encode("utf-8")},
+            timeout=http_timeout("thegraph"),
+        )
+    if response.status_code != 200:
+        logger.error(f"Publishing to TheGraph failed with response '{response.text}'")
+        return None
+
+    try:
+        ipfs_hash = response.json()["Hash"]
+    except (json.JSONDecodeError, KeyError):
+        logger.error(f"TheGraph returned an invalid JSON response: '{response.text}'")
+        return None
+
+    with stage("batch", "pinata_pin"):
+        response = http_session("pinata").post(
+            PINATA_ENDPOINT,
+            headers={
+                "pinata_api_key": PINATA_API_KEY,
+                "pinata_secret_api_key": PINATA_SECRET_API_KEY,
+            },
+            json={"hashToPin": ipfs_hash},
+            timeout=http_timeout("pinata"),
+        )
+    if response.status_code != 200:
+        logger.error(f"Pinning on Pinata failed with response '{response.text}'")
+        return None
+    return ipfs_hash
+
+
+def _batch_publish(session, force=False):
+    # get a bounded set of annotations from the DB that aren't published yet
+    with stage("batch", "claim"):
+        annotations = claim_unpublished(session)
+    logger.info(f"Claimed {len(annotations)} unpublished annotations")
+    if not annotations or (len(annotations) < BATCH_SIZE and not force):
         # if number below threshold, exit
         logger.info("Skipping batch submission due to insufficient batch size")
         return
 
     # construct batch JSON with annotation cids
     batch_id = str(uuid4())
+    cids = [annotation.subject_id for annotation in annotations]
+    if BATCH_FORMAT == "v2":
+        # commit to the CIDs through a constant-size Merkle root
+        with stage("batch", "merkle"):
+            levels = merkle_tree(cids)
+            for index, annotation in enumerate(annotations):
+                annotation.batch_proof = merkle_proof(levels, index)
+        # the leaves are published on their own, so that registry consumers
+        # can find the members and check them against the signed root
+        logger.info("Adding and pinning the batch member list")
+        members_cid = _ipfs_add({"cids": cids})
+        if members_cid is None:
+            return
+        credential_subject = {
+            "id": batch_id,
+            "merkleRoot": merkle_root(levels),
+            "count": len(cids),
+            "members": members_cid,
+        }
+    else:
+        credential_subject = {"id": batch_id, "content": cids}
+
     batch = {
-        "@context": ["https://pan.network/batch/v1"],
+        "@context": [f"https://pan.network/batch/{BATCH_FORMAT}"],
         "type": ["VerifiableCredential", "PANBatchCredential"],
         "issuer": "urn:ethereum:" + PUBLISHER_PUBKEY,
         "issuanceDate": datetime.now().isoformat(),
-        "credentialSubject": {
-            "id": batch_id,
-            "content": [annotation.subject_id for annotation in annotations],
-        },
+        "credentialSubject": credential_subject,
         "proof": {
             "type": "EthereumECDSA",
             "created": datetime.now().isoformat(),
@@ -73,37 +251,18 @@ def batch_publish():
         annotation.batch_id = batch_id
 
     # sign batch with publisher private key
-    sig: SignedMessage = PUBLISHER_ACCOUNT.sign_message(
-        encode_defunct(text=json.dumps(batch, sort_keys=True, separators=(",", ":")))
-    )
+    with stage("batch", "sign"):
+        sig: SignedMessage = PUBLISHER_ACCOUNT.sign_message(
+            encode_defunct(
+                text=json.dumps(batch, sort_keys=True, separators=(",", ":"))
+            )
+        )
     batch["proof"]["jws"] = sig.signature.hex()
 
     # publish and pin batch claim on IPFS (TheGraph and Pinata)
-    logger.info("Adding and pinning annotation on TheGraph")
-    response = requests.post(
-        THEGRAPH_IPFS_ENDPOINT, files={"batch.json": json.dumps(batch).encode("utf-8")}
-    )
-    if response.status_code != 200:
-        logger.error(f"Publishing to TheGraph failed with response '{response.text}'")
-        return
-
-    try:
-        ipfs_hash = response.json()["Hash"]
-    except (json.JSONDecodeError, KeyError):
-        logger.error(f"TheGraph returned an invalid JSON response: '{response.text}'")
-        return
-
-    logger.info("Pinning annotation to Pinata")
-    response = requests.post(
-        PINATA_ENDPOINT,
-        headers={
-            "pinata_api_key": PINATA_API_KEY,
-            "pinata_secret_api_key": PINATA_SECRET_API_KEY,
-        },
-        json={"hashToPin": ipfs_hash},
-    )
-    if response.status_code != 200:
-        logger.error(f"Pinning on Pinata failed with response '{response.text}'")
+    logger.info("Adding and pinning the batch on TheGraph and Pinata")
+    ipfs_hash = _ipfs_add(batch)
+    if ipfs_hash is None:
         return
 
     logger.info(f"Published batch at content hash {ipfs_hash}")
@@ -111,42 +270,162 @@ def batch_publish():
     for annotation in annotations:
         logger.info(f"Marking annotation {annotation.id} as published")
         annotation.published = True
+        annotation.batch_cid = ipfs_hash
 
-    logger.info("Starting registry batch transaction")
-    w3 = web3.Web3(web3.HTTPProvider(INFURA_URL))
-    registry = w3.eth.contract(REGISTRY_CONTRACT, abi=REGISTRY_ABI)
-    logger.info("Build raw registry transaction")
-    tx = registry.functions.storeCID(ipfs_hash).buildTransaction(
-        {
-            "nonce": w3.eth.getTransactionCount(PUBLISHER_ACCOUNT.address),
-            "chainId": 3,  # 1 = mainnet, 3 = ropsten
-            "gas": 25_000,
-            "gasPrice": w3.toWei("10", "gwei"),
-        }
-    )
-    logger.info("Signing raw transaction with publisher key")
-    signed_tx = w3.eth.account.signTransaction(
-        tx, private_key=PUBLISHER_ACCOUNT.privateKey
-    )
-    logger.info("Sending raw transaction")
-    tx_hash = w3.eth.sendRawTransaction(signed_tx.rawTransaction)
-    logger.info(f"Published batch to registry in transaction {tx_hash.hex()}")
+    logger.info("Submitting batch to the registry")
+    with stage("batch", "registry_submit"):
+        tx_hash = registry_submitter.submit(ipfs_hash)
+    logger.info(f"Published batch to registry in transaction {tx_hash}")
 
     # store in DB
     logger.info("Committing batch state changes")
     try:
-        session.commit()
+        with stage("batch", "db_commit"):
+            session.commit()
     except SQLAlchemyError as e:
         logger.error(f"Encountered error during database commit: {e}")
         session.rollback()
+    else:
+        # cached responses still show these annotations as unpublished
+        response_cache.invalidate(cids)
 
     return ipfs_hash  # so we can see the CID in the job dashboard results
 
 
+def _retry_countdown(task):
+    return min(2 ** task.request.retries * 5, 600)
+
+
+@app.task(bind=True, max_retries=IPFS_PUBLISH_RETRIES)
+def publish_annotation(self, payload, cid):
+    logger.info(f"Adding annotation {cid} on TheGraph")
+    try:
+        response = http_session("thegraph").post(
+            THEGRAPH_IPFS_ENDPOINT,
+            files={"batch.json": payload.encode("utf-8")},
+            timeout=http_timeout("thegraph"),
+        )
+    except (ConnectionError, ReadTimeout) as e:
+        logger.warning(f"Connection to TheGraph timed out: {e}")
+        raise self.retry(exc=e, countdown=_retry_countdown(self))
+
+    if response.status_code != 200:
+        logger.warning(f"Publishing to TheGraph failed with response '{response.text}'")
+        raise self.retry(countdown=_retry_countdown(self))
+
+    try:
+        ipfs_hash = response.json()["Hash"]
+    except (json.JSONDecodeError, KeyError):
+        logger.warning(f"TheGraph returned an invalid JSON response: '{response.text}'")
+        raise self.retry(countdown=_retry_countdown(self))
+
+    if ipfs_hash != cid:
+        # the row stays out of batches, its CID doesn't resolve
+        logger.error(
+            f"TheGraph stored annotation {cid} under a different CID {ipfs_hash}"
+        )
+        return ipfs_hash
+
+    session = sessionmaker(bind=engine)()
+    try:
+        session.query(Annotation).filter(Annotation.subject_id == cid).update(
+            {Annotation.pending_payload: None}, synchronize_session=False
+        )
+        session.commit()
+    except SQLAlchemyError as e:
+        logger.warning(f"Failed to mark annotation {cid} as uploaded: {e}")
+        session.rollback()
+        raise self.retry(exc=e, countdown=_retry_countdown(self))
+    finally:
+        session.close()
+
+    pin_cid.delay(ipfs_hash)
+    trigger_batch()
+    return ipfs_hash
+
+
+def queue_uploads(uploads):
+    """Queue the IPFS uploads of committed deferred submissions.
+
+    Takes (payload, cid) pairs; the rows keep their payload until the upload
+    succeeds, so uploads that never ran are picked up by the sweep.
+    """
+    for payload, cid in uploads:
+        publish_annotation.delay(payload, cid)
+
+
+@app.task
+def sweep_pending_uploads():
+    """Re-queue deferred uploads that are still outstanding.
+
+    Covers uploads that ran out of retries and ones that were never queued,
+    e.g. because the broker was down when the submission committed.
+    """
+    session = sessionmaker(bind=engine)()
+    try:
+        rows = (
+            session.query(Annotation.id, Annotation.subject_id)
+            .filter(
+                Annotation.pending_payload != None,
+                Annotation.modified
+                < func.now() - timedelta(seconds=IPFS_PUBLISH_SWEEP_AGE),
+            )
+            .order_by(Annotation.modified)
+            .limit(BATCH_MAX_SIZE)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not rows:
+            return 0
+        ids = [row.id for row in rows]
+        # the next sweep leaves these alone until they are old again
+        session.query(Annotation).filter(Annotation.id.in_(ids)).update(
+            {Annotation.modified: func.now()}, synchronize_session=False
+        )
+        uploads = (
+            session.query(Annotation.pending_payload, Annotation.subject_id)
+            .filter(Annotation.id.in_(ids))
+            .all()
+        )
+        session.commit()
+    finally:
+        session.close()
+
+    logger.info(f"Re-queueing {len(uploads)} outstanding IPFS uploads")
+    queue_uploads(uploads)
+    return len(uploads)
+
+
+@app.task(bind=True, max_retries=IPFS_PUBLISH_RETRIES)
+def pin_cid(self, cid):
+    logger.info(f"Pinning {cid} to Pinata")
+    try:
+        response = http_session("pinata").post(
+            PINATA_ENDPOINT,
+            headers={
+                "pinata_api_key": PINATA_API_KEY,
+                "pinata_secret_api_key": PINATA_SECRET_API_KEY,
+            },
+            json={"hashToPin": cid},
+            timeout=http_timeout("pinata"),
+        )
+    except (ConnectionError, ReadTimeout) as e:
+        logger.warning(f"Connection to Pinata timed out: {e}")
+        raise self.retry(exc=e, countdown=_retry_countdown(self))
+
+    if response.status_code != 200:
+        logger.warning(f"Pinning on Pinata failed with response '{response.text}'")
+        raise self.retry(countdown=_retry_countdown(self))
+    return cid
+
+
 ANNOTATION_LIST_QUERY = gql(
     """
-query MyQuery ($first: Int = 10, $skip: Int = 0) {
-  annotations (first: $first, skip: $skip) {
+query AnnotationsAfter ($first: Int = 100, $last: String = "") {
+  annotations (
+    first: $first, where: { id_gt: $last }, orderBy: id, orderDirection: asc
+  ) {
+    id
     cid
     batchCID
   }
@@ -155,20 +434,199 @@ query MyQuery ($first: Int = 10, $skip: Int = 0) {
 )
 
 
-def fetch_registry_annotations(client, offset, limit):
+def fetch_registry_annotations(client, last_id, limit):
     start_time = time.time()
     try:
         annotations = client.execute(
-            ANNOTATION_LIST_QUERY, variable_values={"first": limit, "skip": offset}
+            ANNOTATION_LIST_QUERY, variable_values={"first": limit, "last": last_id}
         ).get("annotations", [])
-    except ClientConnectionError:
-        logger.warning("The IPFS gateway server dropped the connection - skipping")
-        return []
+    except SubgraphError as e:
+        logger.warning(f"The subgraph query failed - skipping: {e}")
+        return None
+
+    duration = time.time() - start_time
+    observe("sync", "subgraph", duration)
+    logger.info(f"Fetched {len(annotations)} annotations in {duration} seconds")
+    return annotations
+
+
+def _valid_batch(batch):
+    # anyone can sign a batch naming themselves as issuer, so the signer must
+    # also be a publisher we trust
+    try:
+        issuer = batch["issuer"].split(":")[-1].lower()
+        signer = recover_batch_issuer(batch).lower()
+    except Exception as e:
+        logger.warning(f"Failed to verify batch signature: {e}")
+        return False
+    return signer == issuer and signer in TRUSTED_PUBLISHERS
+
+
+def _merkle_members(subject, member_list):
+    """The CIDs of a v2 member list, or None unless they hash to the signed root."""
+    cids = member_list.get("cids") if isinstance(member_list, dict) else None
+    if (
+        not isinstance(cids, list)
+        or not cids
+        or not all(isinstance(cid, str) for cid in cids)
+        or len(cids) != subject.get("count")
+    ):
+        return None
+    if merkle_root(merkle_tree(cids)) != subject.get("merkleRoot"):
+        return None
+    return cids
 
+
+def verify_registry_batches(repository, annotations, cids):
+    """Filter new CIDs down to members of validly signed batches.
+
+    Each distinct batch credential is fetched and verified once per page
+    instead of once per annotation. Returns the CIDs to resolve and the CIDs
+    whose batch or member list couldn't be fetched, which should be retried
+    later.
+    """
+    batch_members = defaultdict(list)
+    unbatched = []
+    batch_cids = {a["cid"]: a.get("batchCID") for a in annotations}
+    for cid in cids:
+        if batch_cids.get(cid):
+            batch_members[batch_cids[cid]].append(cid)
+        else:
+            unbatched.append(cid)
+
+    batches, batch_failures = repository.resolve_cids(list(batch_members))
+    subjects = {}
+    for batch_cid, batch in batches:
+        if not _valid_batch(batch):
+            logger.warning(
+                f"Dropping members of batch {batch_cid} with a bad signature"
+            )
+            continue
+        subject = batch.get("credentialSubject")
+        subjects[batch_cid] = subject if isinstance(subject, dict) else {}
+
+    # v1 batches list their members, v2 batches sign a Merkle root and point
+    # to a separately published member list
+    member_list_cids = {}
+    for batch_cid, subject in subjects.items():
+        if "merkleRoot" in subject:
+            list_cid = subject.get("members")
+            member_list_cids[batch_cid] = (
+                list_cid if isinstance(list_cid, str) else None
+            )
+    member_lists, member_failures = repository.resolve_cids(
+        [cid for cid in member_list_cids.values() if cid is not None]
+    )
+    member_lists = dict(member_lists)
+
+    accepted = list(unbatched)
+    failures = {
+        cid: f"Batch {batch_cid} unavailable: {error}"
+        for batch_cid, error in batch_failures.items()
+        for cid in batch_members[batch_cid]
+    }
+    for batch_cid, subject in subjects.items():
+        if batch_cid in member_list_cids:
+            list_cid = member_list_cids[batch_cid]
+            if list_cid in member_failures:
+                for cid in batch_members[batch_cid]:
+                    failures[cid] = (
+                        f"Members of batch {batch_cid} unavailable: "
+                        f"{member_failures[list_cid]}"
+                    )
+                continue
+            listed = _merkle_members(subject, member_lists.get(list_cid))
+        else:
+            listed = subject.get("content")
+        if not isinstance(listed, list):
+            logger.warning(
+                f"Dropping members of batch {batch_cid} without a verifiable "
+                f"member list"
+            )
+            continue
+
+        listed = set(listed)
+        for cid in batch_members[batch_cid]:
+            if cid in listed:
+                accepted.append(cid)
+            else:
+                logger.warning(f"Annotation {cid} is not listed in batch {batch_cid}")
+    return accepted, failures
+
+
+def sync_registry_page(session, repository, annotations, checkpoint=None):
+    start_time = time.time()
+    cids = list({annotation["cid"] for annotation in annotations})
+
+    # resolve which CIDs we already know with a single set-based lookup
+    known = repository.known_cids(cids)
+    lookup_time = time.time()
+
+    # registry CIDs are arbitrary strings; the ones that can't be stored are
+    # dropped before any IPFS traffic
+    new_cids = []
+    for cid in cids:
+        if cid in known:
+            continue
+        if len(cid) > Annotation.subject_id.type.length:
+            logger.warning(f"Dropping registry annotation {cid}: CID too long")
+            continue
+        new_cids.append(cid)
+
+    # fetch new annotations from IPFS concurrently; only these failures are
+    # worth retrying, a malformed document stays malformed
+    failures = {}
+    if REGISTRY_SYNC_MODE == "batch":
+        new_cids, failures = verify_registry_batches(repository, annotations, new_cids)
+    results, fetch_failures = repository.resolve_cids(new_cids)
+    failures.update(fetch_failures)
+    documents = dict(results)
+    fetch_time = time.time()
+
+    inserted = 0
+    rejected = {}
+    committed = True
+    try:
+        # bulk_insert_published logs the documents it rejects
+        inserted, rejected = repository.bulk_insert_published(documents)
+        if checkpoint is not None:
+            # advance the high-water mark in the same transaction as the rows;
+            # pages come in the subgraph's id order, which Python's string
+            # order needn't match, and retried pending entries carry no id
+            if annotations and "id" in annotations[-1]:
+                checkpoint.last_id = annotations[-1]["id"]
+            checkpoint.pending_cids = sorted(
+                (set(checkpoint.pending_cids) - set(cids)) | set(failures)
+            )
+        session.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Encountered error during database commit: {e}")
+        session.rollback()
+        committed = False
+
+    end_time = time.time()
+    observe("sync", "lookup", lookup_time - start_time)
+    observe("sync", "fetch", fetch_time - lookup_time)
+    observe("sync", "insert", end_time - fetch_time)
+    observe("sync", "page", end_time - start_time)
     logger.info(
-        f"Fetched {len(annotations)} annotations in {time.time() - start_time} seconds"
+        f"Synced page of {len(cids)} CIDs ({len(known)} known, "
+        f"{len(documents)} fetched, {len(failures)} failed, "
+        f"{len(rejected)} rejected, {inserted} inserted) "
+        f"in {end_time - start_time:.3f} seconds "
+        f"(lookup {lookup_time - start_time:.3f}s, "
+        f"fetch {fetch_time - lookup_time:.3f}s, "
+        f"insert {end_time - fetch_time:.3f}s)"
     )
-    return annotations
+    return {
+        "cids": len(cids),
+        "known": len(known),
+        "fetched": len(documents),
+        "failed": len(failures),
+        "rejected": len(rejected),
+        "inserted": inserted,
+        "committed": committed,
+    }
 
 
 @app.task
@@ -176,64 +634,89 @@ def sync_registry():
     logger.info("Synchronizing with the contract registry")
     session: Session = sessionmaker(bind=engine)()
     repository = AnnotationsRepository(session)
-    gql_client = Client(transport=AIOHTTPTransport(url=PAN_SUBGRAPH))
-
-    offset = 0
+    checkpoint = SyncCheckpoint.load(session, REGISTRY_CHECKPOINT)
     limit = 100
-    annotations = fetch_registry_annotations(
-        client=gql_client, offset=offset, limit=limit
-    )
 
-    while annotations:
-        # TODO: This takes long - parallelize
-        for annotation in annotations:
-            # skip if annotation already in DB
-            try:
-                annotation_exists = (
-                    session.query(Annotation)
-                    .filter_by(subject_id=annotation["cid"])
-                    .scalar()
-                )
-            except MultipleResultsFound:
-                annotation_exists = True
-            if annotation_exists is not None:
-                continue
+    try:
+        # retry entries whose content couldn't be resolved in earlier runs
+        if checkpoint.pending_cids:
+            logger.info(f"Retrying {len(checkpoint.pending_cids)} unresolved CIDs")
+            if REGISTRY_SYNC_MODE == "batch":
+                # batch verification needs each entry's batchCID again; the id
+                # is dropped so that the retry leaves the checkpoint in place
+                pending = [
+                    {"cid": entry["cid"], "batchCID": entry.get("batchCID")}
+                    for entry in repository.get_registry_entries(
+                        checkpoint.pending_cids
+                    )
+                ]
+            else:
+                pending = [{"cid": cid} for cid in checkpoint.pending_cids]
+            sync_registry_page(session, repository, pending, checkpoint)
 
-            # fetch new annotation from IPFS and create DB object
-            try:
-                content = repository.get_subgraph_annotation(
-                    annotation_id=annotation["cid"]
-                )[0]
-            except IndexError:
-                continue
-            # content = repository.get_by_cid(annotation_id=annotation["cid"], published=True)[0]
-            annotation_obj = Annotation(
-                context=content["@context"],
-                credential_type=content["type"],
-                issuer=content["issuer"].split(":")[2],
-                issuance_date=dateutil.parser.parse(content["issuanceDate"]),
-                original_content=content["credentialSubject"]["content"],
-                annotation_content=content["credentialSubject"]["annotation"],
-                proof_type=content["proof"]["type"],
-                proof_date=dateutil.parser.parse(content["proof"]["created"]),
-                proof_purpose=content["proof"]["proofPurpose"],
-                verification_method=content["proof"]["verificationMethod"],
-                proof_jws=content["proof"]["jws"],
-                subject_id=annotation["cid"],
-                published=True,
+        # resume from the last processed registry entry
+        logger.info(f"Resuming registry sync after '{checkpoint.last_id}'")
+        annotations = fetch_registry_annotations(
+            client=subgraph_client, last_id=checkpoint.last_id, limit=limit
+        )
+        while annotations:
+            stats = sync_registry_page(session, repository, annotations, checkpoint)
+            if not stats["committed"]:
+                break
+            annotations = fetch_registry_annotations(
+                client=subgraph_client, last_id=checkpoint.last_id, limit=limit
             )
+    finally:
+        session.close()
 
-            try:
-                session.add(annotation_obj)
-                session.commit()
-            except SQLAlchemyError as e:
-                logger.error(f"Encountered error during database commit: {e}")
-                session.rollback()
 
-        offset += limit
-        annotations = fetch_registry_annotations(
-            client=gql_client, offset=offset, limit=limit
+@app.task
+def confirm_registry_transactions():
+    confirmed = registry_submitter.confirm()
+    logger.info(f"Confirmed {confirmed} registry transactions")
+    return confirmed
+
+
+@worker_process_init.connect
+def start_metrics_server(**kwargs):
+    """Expose the worker's metrics on a side port, the API serves /metrics."""
+    if not METRICS_WORKER_PORT:
+        return
+    registry = metrics_registry(
+        RuntimeCollector(
+            engine=engine,
+            broker_url=CELERY_BROKER,
+            stats={
+                "document_cache": document_cache.stats,
+                "http": http_stats,
+                "signature_cache": signature_cache.stats,
+            },
         )
+    )
+    try:
+        start_http_server(METRICS_WORKER_PORT, registry=registry)
+    except OSError as e:
+        # with several worker processes only the first one gets the port, set
+        # PROMETHEUS_MULTIPROC_DIR to aggregate all of them
+        logger.warning(f"Not serving worker metrics on {METRICS_WORKER_PORT}: {e}")
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    # a task is forced with apply_async(headers={"profile": PROFILE_TOKEN})
+    if not (sampler.forced(task.request.get("profile")) or sampler.sample()):
+        return
+    profiler = sampler.start()
+    if profiler is not None:
+        _task_profiles[task_id] = (profiler, time.perf_counter())
+
+
+@task_postrun.connect
+def finish_task_profile(task_id=None, task=None, **kwargs):
+    entry = _task_profiles.pop(task_id, None)
+    if entry is not None:
+        profiler, start_time = entry
+        sampler.finish(profiler, "task", task.name, time.perf_counter() - start_time)
 
 
 app.conf.beat_schedule = {
@@ -241,5 +724,15 @@ app.conf.beat_schedule = {
         "task": "pan_publisher.api.background.sync_registry",
         "schedule": 300,
         "options": {"expires": 10.0},
-    }
+    },
+    "confirm-registry-transactions": {
+        "task": "pan_publisher.api.background.confirm_registry_transactions",
+        "schedule": REGISTRY_CONFIRM_INTERVAL,
+        "options": {"expires": 10.0},
+    },
+    "sweep-pending-uploads": {
+        "task": "pan_publisher.api.background.sweep_pending_uploads",
+        "schedule": 600,
+        "options": {"expires": 10.0},
+    },
 }
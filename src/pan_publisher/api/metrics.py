@@ -0,0 +1,11 @@
+import falcon
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+
+class MetricsResource:
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_get(self, req: falcon.Request, res: falcon.Response):
+        res.content_type = CONTENT_TYPE_LATEST
+        res.data = generate_latest(self.registry)
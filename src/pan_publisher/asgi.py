@@ -0,0 +1,61 @@
+import falcon.asgi
+from loguru import logger
+
+from pan_publisher.api.annotations_async import (
+    AsyncAnnotationExportResource,
+    AsyncAnnotationProofResource,
+    AsyncAnnotationResource,
+)
+from pan_publisher.middleware import AsyncDatabaseSessionManager, RequireJSON
+from pan_publisher.repository import database
+from pan_publisher.repository.annotations import AsyncAnnotationsRepository
+from pan_publisher.utils.http import close_async_http_clients
+from pan_publisher.utils.pagination import PaginationMiddleware
+
+
+class AsyncPublisherAPI(falcon.asgi.App):
+    """The annotation read and submit endpoints served under uvicorn.
+
+    Bulk submission stays on the WSGI app: its cost is signature recovery in
+    the process pool, not waiting on I/O.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        logger.info("ASGI API Server is starting")
+
+        annotations_repository = AsyncAnnotationsRepository(database.async_db_session)
+
+        self.add_route(
+            "/annotations/", AsyncAnnotationResource(annotations_repository)
+        )
+        self.add_route(
+            "/annotations/{annotation_id}",
+            AsyncAnnotationResource(annotations_repository),
+        )
+        self.add_route(
+            "/annotations/export",
+            AsyncAnnotationExportResource(annotations_repository),
+        )
+        self.add_route(
+            "/annotations/{annotation_id}/proof",
+            AsyncAnnotationProofResource(annotations_repository),
+        )
+
+
+class Lifespan:
+    async def process_shutdown(self, scope, event):
+        await close_async_http_clients()
+        if database.async_engine is not None:
+            await database.async_engine.dispose()
+
+
+# the WSGI app owns schema creation and the registry sync kick-off
+database.init_async_session()
+middleware = [
+    Lifespan(),
+    RequireJSON(),
+    AsyncDatabaseSessionManager(database.async_db_session),
+    PaginationMiddleware(),
+]
+application = AsyncPublisherAPI(middleware=middleware, cors_enable=True)
@@ -1,6 +1,7 @@
 import os
 
 from eth_account import Account
+from eth_utils import is_address
 
 
 class ConfigurationError(Exception):
@@ -16,6 +17,10 @@ try:
     TOKEN_LENGTH = int(os.environ.get("TOKEN_LENGTH", 16))
 except ValueError:
     raise ConfigurationError("TOKEN_LENGTH must be a valid integer")
+try:
+    TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10_000))
+except ValueError:
+    raise ConfigurationError("TOKEN_CACHE_SIZE must be a valid integer")
 
 TOKEN_CHARSET = os.environ.get("TOKEN_CHARSET", "".join(map(chr, range(48, 58))))
 
@@ -35,6 +40,9 @@ DB_AUTOCOMMIT = True
 DATABASE_URL = "postgresql+psycopg2://{user}:{password}@{host}/{database}".format(
     user=DB_USER, password=DB_PASSWORD, host=DB_HOST, database=DB_NAME
 )
+ASYNC_DATABASE_URL = "postgresql+asyncpg://{user}:{password}@{host}/{database}".format(
+    user=DB_USER, password=DB_PASSWORD, host=DB_HOST, database=DB_NAME
+)
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
 PINATA_API_KEY = os.environ.get("PINATA_API_KEY")
@@ -51,12 +59,37 @@ if not PUBLISHER_PRIVKEY:
 PUBLISHER_ACCOUNT = Account.from_key(PUBLISHER_PRIVKEY)
 PUBLISHER_PUBKEY = PUBLISHER_ACCOUNT.address
 BATCH_SIZE = 2
+# "v1" inlines every annotation CID into the batch credential, "v2" only signs a
+# Merkle root over them, publishes the CID list as a separate IPFS document and
+# stores each annotation's inclusion proof
+BATCH_FORMAT = os.environ.get("BATCH_FORMAT", "v1")
+if BATCH_FORMAT not in ("v1", "v2"):
+    raise ConfigurationError("BATCH_FORMAT must be either v1 or v2")
+try:
+    BATCH_MAX_SIZE = int(
+        os.environ.get("BATCH_MAX_SIZE", 1000 if BATCH_FORMAT == "v1" else 50_000)
+    )
+    BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", 256 * 1024))
+except ValueError:
+    raise ConfigurationError("Batch size limits must be valid integers")
 REGISTRY_CONTRACT = os.environ.get("REGISTRY_CONTRACT")
 if REGISTRY_CONTRACT is None:
     raise ConfigurationError("Please provide a registry contract address")
 INFURA_URL = os.environ.get("INFURA_URL")
 if INFURA_URL is None:
     raise ConfigurationError("Please provide an Infura endpoint URL")
+try:
+    REGISTRY_CHAIN_ID = int(os.environ.get("REGISTRY_CHAIN_ID", 3))
+    REGISTRY_GAS_LIMIT = int(os.environ.get("REGISTRY_GAS_LIMIT", 25_000))
+    REGISTRY_GAS_PRICE_GWEI = int(os.environ.get("REGISTRY_GAS_PRICE_GWEI", 10))
+    REGISTRY_MAX_GAS_PRICE_GWEI = int(
+        os.environ.get("REGISTRY_MAX_GAS_PRICE_GWEI", 100)
+    )
+    REGISTRY_GAS_BUMP_PERCENT = int(os.environ.get("REGISTRY_GAS_BUMP_PERCENT", 15))
+    REGISTRY_STUCK_TIMEOUT = int(os.environ.get("REGISTRY_STUCK_TIMEOUT", 600))
+    REGISTRY_CONFIRM_INTERVAL = int(os.environ.get("REGISTRY_CONFIRM_INTERVAL", 30))
+except ValueError:
+    raise ConfigurationError("Registry transaction settings must be valid integers")
 
 CELERY_BROKER = os.environ.get("CELERY_BROKER")
 CELERY_BACKEND = os.environ.get("CELERY_BACKEND")
@@ -71,6 +104,12 @@ if (
 ):
     raise ConfigurationError("Missing celery config parameters")
 
+BATCH_TRIGGER_REDIS = os.environ.get("BATCH_TRIGGER_REDIS", CELERY_BROKER)
+try:
+    BATCH_MAX_LATENCY = int(os.environ.get("BATCH_MAX_LATENCY", 300))
+except ValueError:
+    raise ConfigurationError("BATCH_MAX_LATENCY must be a valid integer")
+
 
 THEGRAPH_IPFS_ENDPOINT = os.environ.get("THEGRAPH_IPFS_ENDPOINT")
 if THEGRAPH_IPFS_ENDPOINT is None:
@@ -78,6 +117,56 @@ if THEGRAPH_IPFS_ENDPOINT is None:
         "Please provide a valid TheGraph endpoint for IPFS publishing and pinning"
     )
 
+IPFS_GATEWAY_ENDPOINT = os.environ.get(
+    "IPFS_GATEWAY_ENDPOINT", "https://api.thegraph.com/ipfs/api/v0/cat"
+)
+try:
+    IPFS_RESOLVER_CONCURRENCY = int(os.environ.get("IPFS_RESOLVER_CONCURRENCY", 16))
+    IPFS_RESOLVER_TIMEOUT = float(os.environ.get("IPFS_RESOLVER_TIMEOUT", 1.5))
+except ValueError:
+    raise ConfigurationError("IPFS resolver concurrency and timeout must be numbers")
+
+IPFS_CACHE_DIR = os.environ.get("IPFS_CACHE_DIR")
+try:
+    IPFS_CACHE_MAX_BYTES = int(os.environ.get("IPFS_CACHE_MAX_BYTES", 256 * 1024 ** 2))
+    IPFS_CACHE_HOT_ENTRIES = int(os.environ.get("IPFS_CACHE_HOT_ENTRIES", 4096))
+except ValueError:
+    raise ConfigurationError("IPFS cache size limits must be valid integers")
+
+# "sync" publishes to IPFS before responding, "deferred" computes the CID locally
+# and leaves the gateway upload and Pinata pinning to a background job
+IPFS_PUBLISH_MODE = os.environ.get("IPFS_PUBLISH_MODE", "sync")
+if IPFS_PUBLISH_MODE not in ("sync", "deferred"):
+    raise ConfigurationError("IPFS_PUBLISH_MODE must be either sync or deferred")
+try:
+    IPFS_PUBLISH_RETRIES = int(os.environ.get("IPFS_PUBLISH_RETRIES", 8))
+except ValueError:
+    raise ConfigurationError("IPFS_PUBLISH_RETRIES must be a valid integer")
+try:
+    # deferred uploads still outstanding after this many seconds are re-queued
+    IPFS_PUBLISH_SWEEP_AGE = int(os.environ.get("IPFS_PUBLISH_SWEEP_AGE", 3600))
+except ValueError:
+    raise ConfigurationError("IPFS_PUBLISH_SWEEP_AGE must be a valid integer")
+
+try:
+    BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 1000))
+    BULK_VERIFY_WORKERS = int(os.environ.get("BULK_VERIFY_WORKERS", os.cpu_count()))
+except ValueError:
+    raise ConfigurationError("Bulk submission settings must be valid integers")
+
+SIGNATURE_CACHE_REDIS = os.environ.get("SIGNATURE_CACHE_REDIS")
+try:
+    SIGNATURE_CACHE_SIZE = int(os.environ.get("SIGNATURE_CACHE_SIZE", 10_000))
+    SIGNATURE_CACHE_TTL = int(os.environ.get("SIGNATURE_CACHE_TTL", 3600))
+except ValueError:
+    raise ConfigurationError("Signature cache settings must be valid integers")
+
+RESPONSE_CACHE_REDIS = os.environ.get("RESPONSE_CACHE_REDIS")
+try:
+    RESPONSE_CACHE_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 10_000))
+except ValueError:
+    raise ConfigurationError("RESPONSE_CACHE_ENTRIES must be a valid integer")
+
 REGISTRY_ABI = [
     {
         "inputs": [{"internalType": "string", "name": "cid", "type": "string"}],
@@ -87,6 +176,69 @@ REGISTRY_ABI = [
         "type": "function",
     }
 ]
-PAN_SUBGRAPH = (
-    "https://api.thegraph.com/subgraphs/name/public-annotation-network/subgraph"
+# "annotation" trusts every registry entry on its own, "batch" verifies each
+# entry's batch credential (once per batch) before resolving its members
+REGISTRY_SYNC_MODE = os.environ.get("REGISTRY_SYNC_MODE", "annotation")
+if REGISTRY_SYNC_MODE not in ("annotation", "batch"):
+    raise ConfigurationError("REGISTRY_SYNC_MODE must be either annotation or batch")
+# batch credentials count only if one of these addresses signed them
+TRUSTED_PUBLISHERS = {
+    address.strip().lower()
+    for address in (os.environ.get("TRUSTED_PUBLISHERS") or PUBLISHER_PUBKEY).split(",")
+    if address.strip()
+}
+if not all(is_address(address) for address in TRUSTED_PUBLISHERS):
+    raise ConfigurationError("TRUSTED_PUBLISHERS must be Ethereum addresses")
+
+PAN_SUBGRAPH = os.environ.get(
+    "PAN_SUBGRAPH",
+    "https://api.thegraph.com/subgraphs/name/public-annotation-network/subgraph",
 )
+try:
+    SUBGRAPH_CHUNK_SIZE = int(os.environ.get("SUBGRAPH_CHUNK_SIZE", 100))
+except ValueError:
+    raise ConfigurationError("SUBGRAPH_CHUNK_SIZE must be a valid integer")
+
+
+def _http_policy(name, pool_size, timeout, retries, backoff, idempotent=True):
+    try:
+        return {
+            "pool_size": int(os.environ.get(f"HTTP_{name}_POOL_SIZE", pool_size)),
+            "timeout": float(os.environ.get(f"HTTP_{name}_TIMEOUT", timeout)),
+            "retries": int(os.environ.get(f"HTTP_{name}_RETRIES", retries)),
+            "backoff": float(os.environ.get(f"HTTP_{name}_BACKOFF", backoff)),
+            # whether the dependency's POSTs may be repeated
+            "idempotent": idempotent,
+        }
+    except ValueError:
+        raise ConfigurationError(f"HTTP_{name}_* settings must be numbers")
+
+
+# connection pool, timeout and retry policy per outbound dependency
+HTTP_POLICIES = {
+    "thegraph": _http_policy("THEGRAPH", 4, 5, 2, 0.5),
+    "ipfs_gateway": _http_policy(
+        "IPFS_GATEWAY", IPFS_RESOLVER_CONCURRENCY, IPFS_RESOLVER_TIMEOUT, 1, 0.2
+    ),
+    "pinata": _http_policy("PINATA", 2, 5, 2, 0.5),
+    "subgraph": _http_policy("SUBGRAPH", 4, 10, 2, 0.5),
+    # JSON-RPC posts include eth_sendRawTransaction
+    "infura": _http_policy("INFURA", 2, 10, 2, 0.5, idempotent=False),
+}
+
+try:
+    METRICS_WORKER_PORT = int(os.environ.get("METRICS_WORKER_PORT", 9100))
+except ValueError:
+    raise ConfigurationError("METRICS_WORKER_PORT must be a valid integer")
+
+# share of requests and tasks to profile, can be changed at runtime through
+# PROFILE_CONTROL_REDIS (see utils/profiling.py)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/var/cache/pan/profiles")
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_CONTROL_REDIS = os.environ.get("PROFILE_CONTROL_REDIS", BATCH_TRIGGER_REDIS)
+try:
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.0))
+    PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", 500))
+    PROFILE_REFRESH = float(os.environ.get("PROFILE_REFRESH", 10))
+except ValueError:
+    raise ConfigurationError("Profiling settings must be numbers")
@@ -1,12 +1,27 @@
 import falcon
 from loguru import logger
 
-from pan_publisher.api import AnnotationResource
+from pan_publisher.api import (
+    AnnotationBulkResource,
+    AnnotationExportResource,
+    AnnotationProofResource,
+    AnnotationResource,
+    MetricsResource,
+)
 from pan_publisher.api.background import sync_registry
-from pan_publisher.middleware import DatabaseSessionManager, RequireJSON
+from pan_publisher.config import CELERY_BROKER
+from pan_publisher.middleware import (
+    DatabaseSessionManager,
+    ProfilingMiddleware,
+    RequireJSON,
+)
 from pan_publisher.repository.annotations import AnnotationsRepository
-from pan_publisher.repository.database import db_session, init_session
+from pan_publisher.repository.cache import document_cache, response_cache
+from pan_publisher.repository.database import db_session, engine, init_session
+from pan_publisher.utils.http import http_stats
+from pan_publisher.utils.metrics import RuntimeCollector, metrics_registry
 from pan_publisher.utils.pagination import PaginationMiddleware
+from pan_publisher.utils.signature import signature_cache
 
 
 class PublisherAPI(falcon.App):
@@ -35,11 +50,38 @@ class PublisherAPI(falcon.App):
         self.add_route(
             "/annotations/{annotation_id}", AnnotationResource(annotations_repository)
         )
+        self.add_route(
+            "/annotations/bulk", AnnotationBulkResource(annotations_repository)
+        )
+        self.add_route(
+            "/annotations/export", AnnotationExportResource(annotations_repository)
+        )
+        self.add_route(
+            "/annotations/{annotation_id}/proof",
+            AnnotationProofResource(annotations_repository),
+        )
+
+        # metrics
+        registry = metrics_registry(
+            RuntimeCollector(
+                engine=engine,
+                broker_url=CELERY_BROKER,
+                stats={
+                    "document_cache": document_cache.stats,
+                    "http": http_stats,
+                    "response_cache": response_cache.stats,
+                    "signature_cache": signature_cache.stats,
+                },
+            )
+        )
+        self.add_route("/metrics", MetricsResource(registry))
 
 
 init_session()
 # public_cors = CORS(allow_all_origins=True)
 middleware = [
+    # first in line, so that the other middleware is part of the profile
+    ProfilingMiddleware(),
     RequireJSON(),
     # public_cors.middleware,
     # TokenAuthMiddleware(db_session),
@@ -1,3 +1,4 @@
 from .auth import TokenAuthMiddleware
 from .json import RequireJSON
-from .session import DatabaseSessionManager
+from .profiling import ProfilingMiddleware
+from .session import AsyncDatabaseSessionManager, DatabaseSessionManager, after_commit
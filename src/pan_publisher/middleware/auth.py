@@ -3,7 +3,12 @@ from secrets import compare_digest
 import falcon
 from falcon_auth import FalconAuthMiddleware, TokenAuthBackend
 
-from pan_publisher.config import SECRET_KEY, TOKEN_CHARSET, TOKEN_LENGTH
+from pan_publisher.config import (
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CHARSET,
+    TOKEN_LENGTH,
+)
 from pan_publisher.model import User
 from pan_publisher.utils.auth import AuthManager
 
@@ -20,6 +25,7 @@ class TokenAuthMiddleware(FalconAuthMiddleware):
             secret_key=SECRET_KEY,
             token_charset=TOKEN_CHARSET,
             token_length=TOKEN_LENGTH,
+            cache_size=TOKEN_CACHE_SIZE,
         )
 
     def user_loader(self, token):
@@ -1,15 +1,24 @@
 import falcon
 
+JSON_MEDIA_TYPES = ("application/json", "application/x-ndjson")
+
 
 class RequireJSON(object):
     def process_request(self, req, resp):
-        if not req.client_accepts_json:
+        if not req.client_accepts_json and not req.client_accepts(
+            "application/x-ndjson"
+        ):
             raise falcon.HTTPNotAcceptable(
                 "This API only supports responses encoded as JSON."
             )
 
         if req.method in ("POST", "PUT"):
-            if req.content_type is None or "application/json" not in req.content_type:
+            if req.content_type is None or not any(
+                media_type in req.content_type for media_type in JSON_MEDIA_TYPES
+            ):
                 raise falcon.HTTPUnsupportedMediaType(
                     "This API only supports requests encoded as JSON."
                 )
+
+    async def process_request_async(self, req, resp):
+        self.process_request(req, resp)
@@ -0,0 +1,32 @@
+import time
+
+from pan_publisher.utils.profiling import sampler as default_sampler
+
+# set to PROFILE_TOKEN to profile a single request
+PROFILE_HEADER = "X-Profile"
+
+
+class ProfilingMiddleware:
+    def __init__(self, sampler=default_sampler):
+        self.sampler = sampler
+
+    def process_request(self, req, res):
+        if not (
+            self.sampler.forced(req.get_header(PROFILE_HEADER)) or self.sampler.sample()
+        ):
+            return
+        profiler = self.sampler.start()
+        if profiler is not None:
+            req.context["profiler"] = (profiler, time.perf_counter())
+
+    def process_response(self, req, res, resource=None, req_succeeded=None):
+        entry = req.context.get("profiler")
+        if entry is None:
+            return
+        profiler, start_time = entry
+        name = f"{req.method}-{type(resource).__name__ if resource else 'unrouted'}"
+        filename = self.sampler.finish(
+            profiler, "request", name, time.perf_counter() - start_time
+        )
+        if filename is not None:
+            res.set_header("X-Profile-Id", filename)
@@ -1,9 +1,29 @@
+import asyncio
+
 import falcon
 import sqlalchemy.orm.scoping as scoping
 from loguru import logger
 from sqlalchemy.exc import SQLAlchemyError
 
 from pan_publisher import config
+from pan_publisher.utils.metrics import stage
+
+
+def after_commit(req, callback, *args):
+    """Run ``callback(*args)`` once the request's session has committed.
+
+    Nothing runs when the commit fails, so work that depends on the request's
+    rows, like queueing their IPFS upload, can't outlive a rejected request.
+    """
+    req.context.setdefault("after_commit", []).append((callback, args))
+
+
+def _run_callback(callback, args):
+    try:
+        callback(*args)
+    except Exception as e:
+        # the rows are committed; whatever they still need is swept up later
+        logger.warning(f"Post-commit callback {callback.__name__} failed: {e}")
 
 
 class DatabaseSessionManager:
@@ -27,11 +47,16 @@ class DatabaseSessionManager:
 
         if config.DB_AUTOCOMMIT:
             try:
-                session.commit()
+                # submissions are the only requests with real writes
+                pipeline = "submit" if req.method == "POST" else "read"
+                with stage(pipeline, "db_commit"):
+                    session.commit()
             except SQLAlchemyError as e:
                 logger.warning(f"Encountered error during database commit: {e}")
                 session.rollback()
                 raise falcon.HTTPBadRequest()
+            for callback, args in req.context.get("after_commit", ()):
+                _run_callback(callback, args)
 
         if self._scoped:
             # remove any database-loaded state from all current objects
@@ -39,3 +64,32 @@ class DatabaseSessionManager:
             session.remove()
         else:
             session.close()
+
+
+class AsyncDatabaseSessionManager:
+    """ASGI counterpart of DatabaseSessionManager for an async scoped session."""
+
+    def __init__(self, db_session):
+        self._session_factory = db_session
+
+    async def process_request(self, req, res):
+        req.context["session"] = self._session_factory
+
+    async def process_response(self, req, res, resource, req_succeeded):
+        if not req.context.get("session"):
+            return
+        session = req.context["session"]
+
+        if config.DB_AUTOCOMMIT:
+            try:
+                await session.commit()
+            except SQLAlchemyError as e:
+                logger.warning(f"Encountered error during database commit: {e}")
+                await session.rollback()
+                raise falcon.HTTPBadRequest()
+            loop = asyncio.get_running_loop()
+            for callback, args in req.context.get("after_commit", ()):
+                # queueing talks to Redis, keep it off the event loop
+                await loop.run_in_executor(None, _run_callback, callback, args)
+
+        await session.remove()
@@ -1,11 +1,40 @@
+import hashlib
+import json
 from uuid import uuid4
 
 import dateutil.parser
-from sqlalchemy import Boolean, Column, DateTime, String, Text
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import (
+    DDL,
+    Boolean,
+    Column,
+    DateTime,
+    Index,
+    String,
+    Text,
+    event,
+    func,
+    literal_column,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
 
 from pan_publisher.model import Base
 
+# B-tree index rows are limited to about 2.7 kB, so the prefix index only
+# covers the start of the unbounded content
+CONTENT_PREFIX_LENGTH = 256
+
+
+def content_prefix(column):
+    # a literal length, so that queries match the index expression even as
+    # server-side prepared statements
+    return func.left(column, literal_column(str(CONTENT_PREFIX_LENGTH)))
+
+
+# the substring index relies on trigram operator classes
+event.listen(
+    Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
+
 
 class Annotation(Base):
     context = ["https://pan.network/annotation/v1"]
@@ -20,9 +49,12 @@ class Annotation(Base):
 
     # annotation data
     subject_id = Column(String(50), nullable=False, unique=True)
+    content_hash = Column(String(64), nullable=True, unique=True)
     original_content = Column(Text(), nullable=False)
     annotation_content = Column(Text(), nullable=True)
     batch_id = Column(UUID(as_uuid=True), default=None, nullable=True)
+    batch_cid = Column(String(50), default=None, nullable=True)
+    batch_proof = Column(ARRAY(String(66)), default=None, nullable=True)
 
     # proof data
     proof_type = "EthereumECDSA"
@@ -32,6 +64,36 @@ class Annotation(Base):
     proof_jws = Column(Text(), nullable=False)
 
     published = Column(Boolean(), default=False)
+    # the submitted document while its deferred IPFS upload is outstanding
+    pending_payload = Column(Text(), default=None, nullable=True)
+
+    __table_args__ = (
+        # keyset pagination walks the list in (issuance_date, id) order
+        Index("ix_annotation_issuance_date_id", issuance_date.desc(), id.desc()),
+        # batch assembly only ever looks at the unpublished backlog
+        Index(
+            "ix_annotation_unpublished",
+            "created",
+            postgresql_where=(published == False),
+        ),
+        # one index per content filter mode: exact, prefix and substring
+        Index(
+            "ix_annotation_original_content_exact",
+            original_content,
+            postgresql_using="hash",
+        ),
+        Index(
+            "ix_annotation_content_prefix",
+            content_prefix(original_content).label("content_prefix"),
+            postgresql_ops={"content_prefix": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_annotation_original_content_trgm",
+            original_content,
+            postgresql_using="gin",
+            postgresql_ops={"original_content": "gin_trgm_ops"},
+        ),
+    )
 
     def get_annotation_id(self):
         return f"urn:uuid:{self.id}"
@@ -73,6 +135,77 @@ class Annotation(Base):
             "published": self.published,
         }
 
+    @classmethod
+    def list_columns(cls):
+        # the columns rendered by row_to_dict, in row order
+        return (
+            cls.id,
+            cls.issuer,
+            cls.issuance_date,
+            cls.subject_id,
+            cls.original_content,
+            cls.annotation_content,
+            cls.proof_date,
+            cls.verification_method,
+            cls.proof_jws,
+            cls.published,
+        )
+
+    @classmethod
+    def row_to_dict(cls, row):
+        """Render a list_columns() row exactly like to_dict() renders an entity."""
+        (
+            id,
+            issuer,
+            issuance_date,
+            subject_id,
+            original_content,
+            annotation_content,
+            proof_date,
+            verification_method,
+            proof_jws,
+            published,
+        ) = row
+        return {
+            "@context": cls.context,
+            "id": "urn:uuid:" + str(id),
+            "type": cls.credential_type,
+            "issuer": "urn:ethereum:" + issuer,
+            "issuanceDate": issuance_date.isoformat(),
+            "credentialSubject": {
+                "id": "urn:cid:" + subject_id,
+                "content": original_content,
+                "annotation": annotation_content,
+            },
+            "proof": {
+                "type": cls.proof_type,
+                "created": proof_date.isoformat(),
+                "proofPurpose": cls.proof_purpose,
+                "verificationMethod": "urn:ethereum:" + verification_method,
+                "jws": proof_jws,
+            },
+            "published": published,
+        }
+
+    def oversized_columns(self):
+        """Names of the string columns whose value exceeds the column length."""
+        oversized = []
+        for column in self.__table__.columns:
+            value = getattr(self, column.key)
+            if (
+                isinstance(column.type, String)
+                and column.type.length
+                and isinstance(value, str)
+                and len(value) > column.type.length
+            ):
+                oversized.append(column.name)
+        return oversized
+
+    @staticmethod
+    def hash_content(candidate):
+        canonical = json.dumps(candidate, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
     @classmethod
     def from_dict(cls, candidate):
         return cls(
@@ -87,6 +220,7 @@ class Annotation(Base):
             proof_purpose=candidate["proof"]["proofPurpose"],
             verification_method=candidate["proof"]["verificationMethod"],
             proof_jws=candidate["proof"]["jws"],
+            content_hash=cls.hash_content(candidate),
         )
 
     def __repr__(self):
@@ -0,0 +1,28 @@
+from sqlalchemy import Column, String
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from pan_publisher.model import Base
+
+
+class SyncCheckpoint(Base):
+    name = Column(String(50), primary_key=True, nullable=False)
+
+    # subgraph entity ID of the last processed registry entry
+    last_id = Column(String(200), nullable=True)
+    # CIDs past the checkpoint whose content couldn't be resolved yet
+    pending_cids = Column(ARRAY(String(50)), nullable=False, default=list)
+
+    @classmethod
+    def get_id(cls):
+        return SyncCheckpoint.name
+
+    @classmethod
+    def load(cls, session, name):
+        checkpoint = session.query(cls).filter(cls.name == name).one_or_none()
+        if checkpoint is None:
+            checkpoint = cls(name=name, last_id="", pending_cids=[])
+            session.add(checkpoint)
+        return checkpoint
+
+    def __repr__(self):
+        return f"<SyncCheckpoint(name='{self.name}', last_id='{self.last_id}')>"
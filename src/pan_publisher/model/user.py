@@ -1,10 +1,13 @@
+import hashlib
+import hmac
 from secrets import compare_digest
 from uuid import uuid4
 
 from sqlalchemy import Column, String
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import validates
 
-from pan_publisher.config import TOKEN_LENGTH
+from pan_publisher.config import SECRET_KEY, TOKEN_LENGTH
 from pan_publisher.model import Base
 
 
@@ -15,6 +18,8 @@ class User(Base):
     username = Column(String(20), nullable=False, unique=True)
     password = Column(String(80), nullable=False)
     token = Column(String(255), nullable=True)
+    # keyed hash of the token, so auth is one index probe instead of a scan
+    token_hash = Column(String(64), nullable=True, unique=True)
 
     sid = Column(String(TOKEN_LENGTH), nullable=True)
 
@@ -25,21 +30,28 @@ class User(Base):
     def get_id(cls):
         return User.id
 
+    @staticmethod
+    def hash_token(token):
+        return hmac.new(
+            SECRET_KEY.encode("utf-8"), token.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+
+    @validates("token")
+    def _set_token_hash(self, key, token):
+        self.token_hash = self.hash_token(token) if token is not None else None
+        return token
+
     @classmethod
     def find_by_token(cls, session, token):
-        result = None
-        collision = False
-        for user in session.query(User).all():
-            if user.token is not None and compare_digest(
-                user.token.encode("utf-8"), token.encode("utf-8")
-            ):
-                if result is not None:
-                    collision = True
-                    continue
-                result = user
-
-        if not collision and result is not None:
-            return result
+        user = (
+            session.query(User)
+            .filter(User.token_hash == cls.hash_token(token))
+            .one_or_none()
+        )
+        if user is not None and compare_digest(
+            user.token.encode("utf-8"), token.encode("utf-8")
+        ):
+            return user
 
     @classmethod
     def find_by_username(cls, session, username):
@@ -1,16 +1,37 @@
-import json
-import time
+from datetime import timezone
+from uuid import uuid4
 
-import requests
-from aiohttp.client_exceptions import ClientConnectionError
-from gql import AIOHTTPTransport, Client, gql
+import dateutil.parser
+from gql import gql
 from loguru import logger
-from requests.exceptions import ConnectionError, ReadTimeout
-from sqlalchemy import desc
+from sqlalchemy import String, and_, desc, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from pan_publisher.config import PAN_SUBGRAPH
-from pan_publisher.model.annotation import Annotation
+from pan_publisher.config import SUBGRAPH_CHUNK_SIZE
+from pan_publisher.model.annotation import (
+    CONTENT_PREFIX_LENGTH,
+    Annotation,
+    content_prefix,
+)
+from pan_publisher.repository import database
+from pan_publisher.repository.ipfs import IPFSResolver
+from pan_publisher.repository.ipfs import resolver as default_resolver
+from pan_publisher.repository.subgraph import (
+    SubgraphClient,
+    SubgraphError,
+    subgraph_client,
+)
+from pan_publisher.utils.pagination import encode_cursor
+from pan_publisher.utils.serialization import dumps
+
+CONTENT_FILTER_MODES = ("exact", "prefix", "contains")
+EXPORT_SINCE_FIELDS = {
+    "issuance": Annotation.issuance_date,
+    "modified": Annotation.modified,
+}
+EXPORT_CHUNK_BYTES = 64 * 1024
 
 ANNOTATION_LIST_QUERY = gql(
     """
@@ -25,8 +46,8 @@ query MyQuery ($first: Int = 10, $skip: Int = 0) {
 
 ANNOTATION_FILTER_QUERY = gql(
     """
-{
-  annotations( id: $id ) {
+query AnnotationsByCID ($first: Int = 100, $cids: [String!]) {
+  annotations (first: $first, where: { cid_in: $cids }) {
     id
     cid
     batchCID
@@ -48,20 +69,96 @@ query MyQuery ($first: Int = 10, $skip: Int = 0, $reference: String) {
 )
 
 
+def _naive_utc(value):
+    # the timestamp columns have no time zone and hold UTC; asyncpg also
+    # refuses to compare them with aware datetimes
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class _NDJSONChunks:
+    """Buffers annotation rows as NDJSON lines into export-sized chunks."""
+
+    def __init__(self):
+        self.lines = []
+        self.size = 0
+        self.first = True
+
+    def add(self, row):
+        line = dumps(Annotation.row_to_dict(row)) + b"\n"
+        self.lines.append(line)
+        self.size += len(line)
+        # flush the first row right away to keep time to first byte low
+        if self.first or self.size >= EXPORT_CHUNK_BYTES:
+            self.first = False
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.lines:
+            return None
+        chunk = b"".join(self.lines)
+        self.lines = []
+        self.size = 0
+        return chunk
+
+
 class AnnotationsRepository:
-    def __init__(self, session: Session):
+    def __init__(
+        self,
+        session: Session,
+        resolver: IPFSResolver = None,
+        client: SubgraphClient = None,
+    ):
         self.session = session
-        self.client = Client(transport=AIOHTTPTransport(url=PAN_SUBGRAPH))
+        self.resolver = resolver or default_resolver
+        self.client = client or subgraph_client
+
+    def get_subgraph_annotations(self, annotation_ids):
+        """Resolve many annotation CIDs through the subgraph and IPFS.
+
+        Cached documents are answered locally. The remaining CIDs are looked up
+        with chunked cid_in queries, and their content is fetched concurrently.
+        Documents are returned in input order.
+        """
+        # IPFS content is immutable, so a cached document needs no lookup at all
+        cache = self.resolver.cache
+        documents = {}
+        missing = []
+        for cid in dict.fromkeys(annotation_ids):
+            document = cache.get(cid) if cache is not None else None
+            if document is not None:
+                documents[cid] = document
+            else:
+                missing.append(cid)
+
+        registered = [a["cid"] for a in self.get_registry_entries(missing)]
+        results, _ = self.resolver.resolve(registered)
+        documents.update(results)
+        return [documents[cid] for cid in annotation_ids if cid in documents]
+
+    def get_registry_entries(self, cids):
+        """Look up the registry entries (id, cid, batchCID) of the given CIDs.
+
+        CIDs are queried in chunks; entries of failed chunks are left out.
+        """
+        entries = []
+        for start in range(0, len(cids), SUBGRAPH_CHUNK_SIZE):
+            chunk = cids[start : start + SUBGRAPH_CHUNK_SIZE]
+            try:
+                tg_resp = self.client.execute(
+                    ANNOTATION_FILTER_QUERY,
+                    variable_values={"first": len(chunk), "cids": chunk},
+                )
+            except SubgraphError as e:
+                logger.warning(f"Subgraph lookup failed - skipping: {e}")
+                continue
+            entries.extend(tg_resp.get("annotations", []))
+        return entries
 
     def get_subgraph_annotation(self, annotation_id):
-        try:
-            tg_resp = self.client.execute(
-                ANNOTATION_FILTER_QUERY, variable_values={"id": annotation_id}
-            )
-        except ClientConnectionError:
-            logger.warning("The IPFS gateway server dropped the connection - skipping")
-            return []
-        return self._resolve_subgraph_response(tg_resp)
+        return self.get_subgraph_annotations([annotation_id])
 
     def get_by_cid(self, annotation_id):
         annotations = (
@@ -72,53 +169,286 @@ class AnnotationsRepository:
         output = [a.to_dict() for a in annotations]
         return output
 
+    def get_proof(self, annotation_id):
+        annotation = (
+            self.session.query(Annotation)
+            .filter(Annotation.subject_id == annotation_id)
+            .one_or_none()
+        )
+        if annotation is None or annotation.batch_proof is None:
+            return None
+        return {
+            "id": annotation.get_subject_id(),
+            "batchId": f"urn:uuid:{annotation.batch_id}",
+            "batchCID": annotation.batch_cid,
+            "proof": annotation.batch_proof,
+        }
+
+    def known_cids(self, cids):
+        if not cids:
+            return set()
+        rows = (
+            self.session.query(Annotation.subject_id)
+            .filter(Annotation.subject_id.in_(cids))
+            .all()
+        )
+        return {row.subject_id for row in rows}
+
+    def known_content_hashes(self, content_hashes):
+        if not content_hashes:
+            return {}
+        rows = (
+            self.session.query(Annotation.content_hash, Annotation.subject_id)
+            .filter(Annotation.content_hash.in_(content_hashes))
+            .all()
+        )
+        return {row.content_hash: row.subject_id for row in rows}
+
     @staticmethod
-    def _resolve_subgraph_response(response):
-        start_time = time.time()
-        output = []
-        for annotation in response.get("annotations", []):
-            # resolve through IPFS gateway
-            try:
-                annotation_data = requests.get(
-                    f"https://api.thegraph.com/ipfs/api/v0/cat?arg={annotation['cid']}",
-                    timeout=1.5,
-                ).json()
-            except (json.JSONDecodeError, ReadTimeout, ConnectionError):
-                logger.warning(f"Failed to decode annotation CID: {annotation['cid']}")
+    def _published_row(cid, content):
+        """Build the insert row of a registry document.
+
+        Raises ValueError for documents that would fail the whole insert.
+        """
+        try:
+            row = {
+                "id": uuid4(),
+                "issuer": content["issuer"].split(":")[2],
+                "issuance_date": dateutil.parser.parse(content["issuanceDate"]),
+                "original_content": content["credentialSubject"]["content"],
+                "annotation_content": content["credentialSubject"]["annotation"],
+                "proof_date": dateutil.parser.parse(content["proof"]["created"]),
+                "verification_method": content["proof"]["verificationMethod"],
+                "proof_jws": content["proof"]["jws"],
+                "content_hash": Annotation.hash_content(content),
+                "subject_id": cid,
+                "published": True,
+            }
+        except (
+            AttributeError,
+            IndexError,
+            KeyError,
+            OverflowError,
+            TypeError,
+            ValueError,
+        ) as e:
+            raise ValueError(f"Malformed annotation document: {type(e).__name__}: {e}")
+
+        for name, value in row.items():
+            column = Annotation.__table__.c[name]
+            if not isinstance(column.type, String):
                 continue
-            output.append(annotation_data)
-        logger.info(
-            f"Gateway content retrieval took {time.time() - start_time} seconds"
+            if value is None and column.nullable:
+                continue
+            if not isinstance(value, str) or "\x00" in value:
+                raise ValueError(f"Malformed annotation document: invalid {name}")
+            if column.type.length and len(value) > column.type.length:
+                raise ValueError(f"Malformed annotation document: {name} too long")
+        return row
+
+    def bulk_insert_published(self, documents):
+        """Insert CID-keyed annotation documents in a single statement.
+
+        Rows whose subject ID or content hash already exists are skipped by the
+        database, so concurrent sync runs and registry entries that duplicate a
+        stored annotation can't fail the page. Malformed documents are left out
+        as well. Returns the number of inserted rows and a dict mapping each
+        malformed document's CID to its error.
+        """
+        rows = []
+        failures = {}
+        for cid, content in documents.items():
+            try:
+                rows.append(self._published_row(cid, content))
+            except ValueError as e:
+                logger.warning(f"Skipping registry annotation {cid}: {e}")
+                failures[cid] = str(e)
+        if not rows:
+            return 0, failures
+        statement = insert(Annotation.__table__).values(rows).on_conflict_do_nothing()
+        result = self.session.execute(statement)
+        return result.rowcount, failures
+
+    def resolve_cids(self, cids):
+        return self.resolver.resolve(cids)
+
+    @staticmethod
+    def _content_filter(filter_value, filter_mode):
+        column = Annotation.original_content
+        if filter_mode == "exact":
+            return column == filter_value
+        if filter_mode == "prefix":
+            # the indexed prefix narrows the rows down, the full column decides
+            return and_(
+                content_prefix(column).startswith(
+                    filter_value[:CONTENT_PREFIX_LENGTH], autoescape=True
+                ),
+                column.startswith(filter_value, autoescape=True),
+            )
+        if filter_mode == "contains":
+            return column.contains(filter_value, autoescape=True)
+        raise ValueError(f"Unknown content filter mode: {filter_mode}")
+
+    def list(self, filter_value, offset, limit, cursor=None, filter_mode="contains"):
+        """Return a page of annotations, newest first, and the cursor of the next page.
+
+        With a cursor of (issuance_date, id), the page starts right after that
+        row via a keyset condition instead of skipping ``offset`` rows.
+        """
+        logger.debug(
+            f"Fetching annotations from DB with filter={filter_value} ({filter_mode}) "
+            f"limit={limit} offset={offset} cursor={cursor}"
         )
-        return output
+        # plain column tuples skip the ORM identity map and attribute
+        # instrumentation, which dominate the cost of large pages
+        query = self.session.query(*Annotation.list_columns()).order_by(
+            desc(Annotation.issuance_date), desc(Annotation.id)
+        )
+        if filter_value is not None:
+            query = query.filter(self._content_filter(filter_value, filter_mode))
+
+        if cursor is not None:
+            query = query.filter(
+                tuple_(Annotation.issuance_date, Annotation.id) < tuple_(*cursor)
+            )
+        else:
+            query = query.offset(offset)
+
+        rows = query.limit(limit).all()
+        output = [Annotation.row_to_dict(row) for row in rows]
+
+        next_cursor = None
+        if rows and len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(last.issuance_date, last.id)
+
+        return output, next_cursor
+
+    def export(
+        self, since=None, since_field="issuance", published=None, batch_size=1000
+    ):
+        """Stream all matching annotations as NDJSON chunks, oldest first.
+
+        The rows come from a server-side cursor in a session of its own, since
+        the request's session is gone by the time the response body streams.
+        """
+        session = Session(bind=self.session.get_bind())
+        try:
+            query = (
+                session.query(*Annotation.list_columns())
+                .execution_options(stream_results=True)
+                .order_by(Annotation.issuance_date, Annotation.id)
+            )
+            if since is not None:
+                since = _naive_utc(since)
+                query = query.filter(EXPORT_SINCE_FIELDS[since_field] >= since)
+            if published is not None:
+                query = query.filter(Annotation.published == published)
+
+            chunks = _NDJSONChunks()
+            for row in query.yield_per(batch_size):
+                chunk = chunks.add(row)
+                if chunk is not None:
+                    yield chunk
+            chunk = chunks.flush()
+            if chunk is not None:
+                yield chunk
+        finally:
+            session.close()
+
 
-    def list(self, filter_value, offset, limit):
-        output = []
-        if filter_value is None:
-            logger.debug(
-                f"Fetching annotations from DB with filter={filter_value} limit={limit} offset={offset}"
+class AsyncAnnotationsRepository:
+    """The database side of AnnotationsRepository for the ASGI app.
+
+    ``session`` is an async scoped session, so every request task gets its own
+    AsyncSession.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def get_by_cid(self, annotation_id):
+        result = await self.session.execute(
+            select(Annotation).filter(Annotation.subject_id == annotation_id)
+        )
+        return [a.to_dict() for a in result.scalars()]
+
+    async def get_proof(self, annotation_id):
+        result = await self.session.execute(
+            select(Annotation).filter(Annotation.subject_id == annotation_id)
+        )
+        annotation = result.scalar_one_or_none()
+        if annotation is None or annotation.batch_proof is None:
+            return None
+        return {
+            "id": annotation.get_subject_id(),
+            "batchId": f"urn:uuid:{annotation.batch_id}",
+            "batchCID": annotation.batch_cid,
+            "proof": annotation.batch_proof,
+        }
+
+    async def known_content_hashes(self, content_hashes):
+        if not content_hashes:
+            return {}
+        result = await self.session.execute(
+            select(Annotation.content_hash, Annotation.subject_id).filter(
+                Annotation.content_hash.in_(content_hashes)
             )
-            annotations = (
-                self.session.query(Annotation)
-                .order_by(desc(Annotation.issuance_date))
-                .offset(offset)
-                .limit(limit)
-                .all()
+        )
+        return {row.content_hash: row.subject_id for row in result}
+
+    async def list(
+        self, filter_value, offset, limit, cursor=None, filter_mode="contains"
+    ):
+        query = select(*Annotation.list_columns()).order_by(
+            desc(Annotation.issuance_date), desc(Annotation.id)
+        )
+        if filter_value is not None:
+            query = query.filter(
+                AnnotationsRepository._content_filter(filter_value, filter_mode)
             )
-            output = [a.to_dict() for a in annotations]
-        elif filter_value is not None:
-            logger.debug(
-                f'Fetching annotations filtered by "{filter_value}" '
-                f"from DB with limit={limit} offset={offset}"
+
+        if cursor is not None:
+            query = query.filter(
+                tuple_(Annotation.issuance_date, Annotation.id) < tuple_(*cursor)
             )
-            annotations = (
-                self.session.query(Annotation)
-                .order_by(desc(Annotation.issuance_date))
-                .filter(Annotation.original_content.like(f"%{filter_value}%"))
-                .offset(offset)
-                .limit(limit)
-                .all()
+        else:
+            query = query.offset(offset)
+
+        rows = (await self.session.execute(query.limit(limit))).all()
+        output = [Annotation.row_to_dict(row) for row in rows]
+
+        next_cursor = None
+        if rows and len(rows) == limit:
+            last = rows[-1]
+            next_cursor = encode_cursor(last.issuance_date, last.id)
+
+        return output, next_cursor
+
+    async def export(
+        self, since=None, since_field="issuance", published=None, batch_size=1000
+    ):
+        # the scoped session proxy has no bind of its own to hand out
+        session = AsyncSession(database.async_engine)
+        try:
+            query = select(*Annotation.list_columns()).order_by(
+                Annotation.issuance_date, Annotation.id
             )
-            output = [a.to_dict() for a in annotations]
+            if since is not None:
+                since = _naive_utc(since)
+                query = query.filter(EXPORT_SINCE_FIELDS[since_field] >= since)
+            if published is not None:
+                query = query.filter(Annotation.published == published)
 
-        return output
+            chunks = _NDJSONChunks()
+            result = await session.stream(query)
+            async for partition in result.partitions(batch_size):
+                for row in partition:
+                    chunk = chunks.add(row)
+                    if chunk is not None:
+                        yield chunk
+            chunk = chunks.flush()
+            if chunk is not None:
+                yield chunk
+        finally:
+            await session.close()
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict, namedtuple
+
+import redis
+from loguru import logger
+
+from pan_publisher.config import (
+    BATCH_MAX_LATENCY,
+    IPFS_CACHE_DIR,
+    IPFS_CACHE_HOT_ENTRIES,
+    IPFS_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_ENTRIES,
+    RESPONSE_CACHE_REDIS,
+)
+
+CID_PATTERN = re.compile(r"^[A-Za-z0-9]+$")
+
+
+class DocumentCache:
+    """CID-keyed cache for immutable IPFS documents.
+
+    Documents are kept in an in-process LRU tier and, if a directory is
+    configured, in an on-disk tier that can be shared between the API and the
+    Celery workers. The disk tier is bounded by total size and evicts the least
+    recently read files first, using the file modification time as recency.
+    """
+
+    def __init__(
+        self,
+        directory=IPFS_CACHE_DIR,
+        max_bytes=IPFS_CACHE_MAX_BYTES,
+        hot_entries=IPFS_CACHE_HOT_ENTRIES,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hot_entries = hot_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, cid):
+        if not CID_PATTERN.match(cid):
+            return None
+        return os.path.join(self.directory, f"{cid}.json")
+
+    def _remember(self, cid, document):
+        with self._lock:
+            self._hot[cid] = document
+            self._hot.move_to_end(cid)
+            while len(self._hot) > self.hot_entries:
+                self._hot.popitem(last=False)
+
+    def get(self, cid):
+        with self._lock:
+            if cid in self._hot:
+                self._hot.move_to_end(cid)
+                self.hits += 1
+                return self._hot[cid]
+
+        path = self._path(cid) if self.directory is not None else None
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    document = json.loads(f.read())
+                os.utime(path)
+            except (OSError, ValueError):
+                pass
+            else:
+                self._remember(cid, document)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return document
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, cid, document):
+        self._remember(cid, document)
+        path = self._path(cid) if self.directory is not None else None
+        if path is None:
+            return
+
+        data = json.dumps(document).encode("utf-8")
+        try:
+            # write atomically so concurrent readers never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write CID {cid} to the document cache: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            over_limit = self._disk_bytes is None or self._disk_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hot_entries": len(self._hot),
+            }
+            # unknown until the first eviction pass, absent without a disk tier
+            if self._disk_bytes is not None:
+                stats["disk_bytes"] = self._disk_bytes
+            return stats
+
+
+CachedResponse = namedtuple("CachedResponse", ["etag", "body", "published"])
+
+
+class ResponseCache:
+    """CID-keyed cache of serialized single-annotation responses.
+
+    Published annotations never change again, so they are kept in an
+    in-process LRU. Unpublished ones flip to published once their batch goes
+    out, so they are only cached in the optional shared Redis tier, where the
+    batch job invalidates them.
+    """
+
+    def __init__(self, redis_url=RESPONSE_CACHE_REDIS, entries=RESPONSE_CACHE_ENTRIES):
+        self.entries = entries
+        self.redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(cid):
+        return f"pan:response:{cid}"
+
+    def _remember(self, cid, entry):
+        with self._lock:
+            self._hot[cid] = entry
+            self._hot.move_to_end(cid)
+            while len(self._hot) > self.entries:
+                self._hot.popitem(last=False)
+
+    def get(self, cid):
+        with self._lock:
+            entry = self._hot.get(cid)
+            if entry is not None:
+                self._hot.move_to_end(cid)
+                self.hits += 1
+                return entry
+
+        stored = None
+        if self.redis is not None:
+            try:
+                stored = self.redis.hgetall(self._key(cid))
+            except redis.RedisError as e:
+                logger.warning(f"Response cache lookup failed: {e}")
+
+        if not stored:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry = CachedResponse(
+            etag=stored[b"etag"].decode("ascii"),
+            body=stored[b"body"],
+            published=stored[b"published"] == b"1",
+        )
+        if entry.published:
+            self._remember(cid, entry)
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def set(self, cid, body, published):
+        entry = CachedResponse(
+            etag=hashlib.sha256(body).hexdigest()[:32], body=body, published=published
+        )
+        if published:
+            self._remember(cid, entry)
+        if self.redis is not None:
+            key = self._key(cid)
+            try:
+                pipeline = self.redis.pipeline()
+                pipeline.hset(
+                    key,
+                    mapping={
+                        "etag": entry.etag,
+                        "body": body,
+                        "published": "1" if published else "0",
+                    },
+                )
+                if not published:
+                    # a safety net in case an invalidation gets lost
+                    pipeline.expire(key, BATCH_MAX_LATENCY * 2)
+                pipeline.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Response cache update failed: {e}")
+        return entry
+
+    def invalidate(self, cids):
+        with self._lock:
+            for cid in cids:
+                self._hot.pop(cid, None)
+        if self.redis is not None and cids:
+            try:
+                self.redis.delete(*[self._key(cid) for cid in cids])
+            except redis.RedisError as e:
+                logger.warning(f"Response cache invalidation failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hot_entries": len(self._hot),
+            }
+
+
+document_cache = DocumentCache()
+response_cache = ResponseCache()
@@ -1,26 +1,42 @@
+from asyncio import current_task
+
 from loguru import logger
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 
 from pan_publisher import config
 
 
+ENGINE_OPTIONS = {
+    "pool_recycle": 3600,
+    "pool_size": 10,
+    "pool_timeout": 30,
+    "max_overflow": 30,
+    "echo": config.DB_ECHO,
+}
+
+
 def get_engine(uri):
     logger.info("Connecting to database")
-    options = {
-        "pool_recycle": 3600,
-        "pool_size": 10,
-        "pool_timeout": 30,
-        "max_overflow": 30,
-        "echo": config.DB_ECHO,
-        "execution_options": {"autocommit": config.DB_AUTOCOMMIT},
-    }
-    return create_engine(uri, **options)
+    return create_engine(
+        uri,
+        execution_options={"autocommit": config.DB_AUTOCOMMIT},
+        **ENGINE_OPTIONS,
+    )
 
 
 db_session = scoped_session(sessionmaker())
 engine = get_engine(config.DATABASE_URL)
 
+# one AsyncSession per asyncio task, i.e. per ASGI request
+async_db_session = async_scoped_session(
+    sessionmaker(class_=AsyncSession, expire_on_commit=False),
+    scopefunc=current_task,
+)
+async_engine = None
+
 
 def init_session():
     db_session.configure(bind=engine)
@@ -28,3 +44,16 @@ def init_session():
     from pan_publisher.model import Base
 
     Base.metadata.create_all(engine)
+
+
+def init_async_session():
+    """Bind the async session to an asyncpg engine; the ASGI app calls this.
+
+    The engine is created lazily so that the WSGI app and the workers don't
+    need asyncpg installed.
+    """
+    global async_engine
+    logger.info("Connecting to database (async)")
+    async_engine = create_async_engine(config.ASYNC_DATABASE_URL, **ENGINE_OPTIONS)
+    async_db_session.configure(bind=async_engine)
+    return async_engine
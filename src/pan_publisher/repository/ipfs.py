@@ -0,0 +1,90 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from requests.exceptions import RequestException
+
+from pan_publisher.config import (
+    IPFS_GATEWAY_ENDPOINT,
+    IPFS_RESOLVER_CONCURRENCY,
+    IPFS_RESOLVER_TIMEOUT,
+)
+from pan_publisher.repository.cache import DocumentCache, document_cache
+from pan_publisher.utils.http import http_session
+
+
+class IPFSResolver:
+    def __init__(
+        self,
+        endpoint=IPFS_GATEWAY_ENDPOINT,
+        concurrency=IPFS_RESOLVER_CONCURRENCY,
+        timeout=IPFS_RESOLVER_TIMEOUT,
+        cache: DocumentCache = document_cache,
+    ):
+        self.endpoint = endpoint
+        self.cache = cache
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+
+        # the gateway pool is sized so that every worker thread can hold a
+        # connection without opening a new one
+        self.http = http_session("ipfs_gateway")
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="ipfs-resolver"
+        )
+
+    def fetch(self, cid):
+        response = self.http.get(
+            self.endpoint, params={"arg": cid}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _fetch_safe(self, cid):
+        try:
+            return self.fetch(cid), None
+        except (json.JSONDecodeError, RequestException) as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    def resolve(self, cids):
+        """Fetch the documents behind the given CIDs concurrently.
+
+        Returns a list of (cid, document) tuples for successful lookups, in
+        input order, and a dict mapping each failed CID to its error.
+        """
+        start_time = time.time()
+        documents = {}
+        missing = []
+        for cid in dict.fromkeys(cids):
+            document = self.cache.get(cid) if self.cache is not None else None
+            if document is not None:
+                documents[cid] = document
+            else:
+                missing.append(cid)
+
+        failures = {}
+        for cid, (document, error) in zip(
+            missing, self.executor.map(self._fetch_safe, missing)
+        ):
+            if error is not None:
+                logger.warning(f"Failed to resolve annotation CID {cid}: {error}")
+                failures[cid] = error
+                continue
+            documents[cid] = document
+            if self.cache is not None:
+                self.cache.set(cid, document)
+
+        results = [(cid, documents[cid]) for cid in cids if cid in documents]
+        logger.info(
+            f"Gateway content retrieval of {len(cids)} CIDs took "
+            f"{time.time() - start_time} seconds ({len(missing)} fetched, "
+            f"{len(failures)} failed)"
+        )
+        return results, failures
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+resolver = IPFSResolver()
@@ -0,0 +1,169 @@
+import json
+import time
+
+import web3
+from loguru import logger
+from web3.exceptions import TransactionNotFound
+
+from pan_publisher.config import (
+    INFURA_URL,
+    PUBLISHER_ACCOUNT,
+    REGISTRY_ABI,
+    REGISTRY_CHAIN_ID,
+    REGISTRY_CONTRACT,
+    REGISTRY_GAS_BUMP_PERCENT,
+    REGISTRY_GAS_LIMIT,
+    REGISTRY_GAS_PRICE_GWEI,
+    REGISTRY_MAX_GAS_PRICE_GWEI,
+    REGISTRY_STUCK_TIMEOUT,
+)
+from pan_publisher.utils.http import http_session, http_timeout
+
+# raise the tracked nonce to the chain's count, but never lower it - our own
+# pending transactions are not part of the chain's confirmed count yet
+RAISE_NONCE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (not current) or tonumber(current) < tonumber(ARGV[1]) then
+  redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('GET', KEYS[1])
+"""
+
+
+class RegistrySubmitter:
+    """Submits storeCID transactions with a nonce shared by all workers.
+
+    The next nonce lives in Redis, so concurrent workers never hand out the
+    same one, and transactions are sent without waiting for receipts. Every
+    outstanding transaction is tracked until ``confirm`` sees its receipt,
+    and transactions that stay unmined for too long are re-sent with the same
+    nonce and a bumped gas price.
+    """
+
+    def __init__(self, redis_client, w3=None, account=PUBLISHER_ACCOUNT):
+        self.redis = redis_client
+        self.w3 = w3 or web3.Web3(
+            web3.HTTPProvider(
+                INFURA_URL,
+                request_kwargs={"timeout": http_timeout("infura")},
+                session=http_session("infura"),
+            )
+        )
+        self.account = account
+        self.registry = self.w3.eth.contract(REGISTRY_CONTRACT, abi=REGISTRY_ABI)
+        self.nonce_key = f"pan:registry:nonce:{account.address}"
+        self.pending_key = f"pan:registry:pending:{account.address}"
+        self._raise_nonce = self.redis.register_script(RAISE_NONCE_SCRIPT)
+
+    def _chain_nonce(self, block_identifier="pending"):
+        return self.w3.eth.getTransactionCount(self.account.address, block_identifier)
+
+    def _allocate_nonce(self):
+        if not self.redis.exists(self.nonce_key):
+            self._raise_nonce(keys=[self.nonce_key], args=[self._chain_nonce()])
+        return self.redis.incr(self.nonce_key) - 1
+
+    def _track(self, entry):
+        self.redis.hset(self.pending_key, entry["nonce"], json.dumps(entry))
+
+    def _send(self, entry):
+        tx = self.registry.functions.storeCID(entry["cid"]).buildTransaction(
+            {
+                "nonce": entry["nonce"],
+                "chainId": REGISTRY_CHAIN_ID,
+                "gas": REGISTRY_GAS_LIMIT,
+                "gasPrice": entry["gas_price"],
+            }
+        )
+        signed_tx = self.w3.eth.account.signTransaction(
+            tx, private_key=self.account.privateKey
+        )
+        # track the hash before sending: a send that fails after reaching the
+        # node may still get mined, and must not be submitted a second time
+        tx_hash = signed_tx.hash.hex()
+        if tx_hash not in entry["hashes"]:
+            entry["hashes"].append(tx_hash)
+        self._track(entry)
+        self.w3.eth.sendRawTransaction(signed_tx.rawTransaction)
+
+    def submit(self, cid):
+        nonce = self._allocate_nonce()
+        entry = {
+            "cid": cid,
+            "nonce": nonce,
+            "gas_price": self.w3.toWei(REGISTRY_GAS_PRICE_GWEI, "gwei"),
+            "hashes": [],
+            "sent_at": time.time(),
+        }
+        try:
+            self._send(entry)
+        except Exception as e:
+            # keep the nonce reserved, the confirmation job re-sends it so
+            # that later transactions don't get stuck behind a gap
+            logger.error(f"Sending registry transaction for {cid} failed: {e}")
+            entry["sent_at"] = 0
+        self._track(entry)
+        logger.info(f"Submitted {cid} to the registry with nonce {nonce}")
+        return entry["hashes"][-1] if entry["hashes"] else None
+
+    def _receipt(self, entry):
+        for tx_hash in entry["hashes"]:
+            try:
+                return self.w3.eth.getTransactionReceipt(tx_hash)
+            except TransactionNotFound:
+                continue
+        return None
+
+    def _bump(self, entry):
+        max_gas_price = self.w3.toWei(REGISTRY_MAX_GAS_PRICE_GWEI, "gwei")
+        # only bump past a price that actually went out
+        if entry["sent_at"]:
+            bumped = entry["gas_price"] * (100 + REGISTRY_GAS_BUMP_PERCENT) // 100
+            entry["gas_price"] = min(bumped, max_gas_price)
+        try:
+            self._send(entry)
+        except Exception as e:
+            # the hash is tracked already, sent_at stays so that the next
+            # confirmation run tries again
+            logger.warning(
+                f"Re-sending registry transaction with nonce {entry['nonce']} "
+                f"failed: {e}"
+            )
+            return
+        entry["sent_at"] = time.time()
+        self._track(entry)
+        logger.info(
+            f"Re-sent registry transaction with nonce {entry['nonce']} "
+            f"at {entry['gas_price']} wei gas price"
+        )
+
+    def confirm(self):
+        """Check outstanding transactions for receipts and re-send stuck ones."""
+        confirmed_nonce = self._chain_nonce("latest")
+        self._raise_nonce(keys=[self.nonce_key], args=[confirmed_nonce])
+
+        confirmed = 0
+        for raw_entry in self.redis.hvals(self.pending_key):
+            entry = json.loads(raw_entry)
+            receipt = self._receipt(entry)
+            if receipt is not None:
+                if receipt["status"] != 1:
+                    logger.error(
+                        f"Registry transaction {receipt['transactionHash'].hex()} "
+                        f"for {entry['cid']} reverted"
+                    )
+                self.redis.hdel(self.pending_key, entry["nonce"])
+                confirmed += 1
+            elif entry["nonce"] < confirmed_nonce:
+                # none of the hashes ever signed for this nonce got mined, so
+                # it was used by a transaction we don't know about
+                logger.error(
+                    f"Registry nonce {entry['nonce']} for {entry['cid']} was consumed "
+                    f"elsewhere - resubmitting"
+                )
+                self.redis.hdel(self.pending_key, entry["nonce"])
+                self.submit(entry["cid"])
+            elif time.time() - entry["sent_at"] > REGISTRY_STUCK_TIMEOUT:
+                self._bump(entry)
+
+        return confirmed
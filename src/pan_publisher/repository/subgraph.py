@@ -0,0 +1,45 @@
+from graphql import DocumentNode, print_ast
+from loguru import logger
+from requests.exceptions import RequestException
+
+from pan_publisher.config import PAN_SUBGRAPH
+from pan_publisher.utils.http import http_session, http_timeout
+
+
+class SubgraphError(Exception):
+    pass
+
+
+class SubgraphClient:
+    """A GraphQL client for the PAN subgraph with one long-lived connection pool.
+
+    The gql client opens and closes a transport session per query, so every
+    lookup paid for a fresh connection. This client keeps a single keep-alive
+    pool for the lifetime of the process, shared by the API and the Celery
+    tasks.
+    """
+
+    def __init__(self, url=PAN_SUBGRAPH):
+        self.url = url
+        self.timeout = http_timeout("subgraph")
+        self.http = http_session("subgraph")
+
+    def execute(self, document: DocumentNode, variable_values=None):
+        try:
+            response = self.http.post(
+                self.url,
+                json={"query": print_ast(document), "variables": variable_values or {}},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            body = response.json()
+        except (RequestException, ValueError) as e:
+            raise SubgraphError(f"Subgraph query failed: {e}")
+
+        if body.get("errors"):
+            logger.warning(f"Subgraph returned errors: {body['errors']}")
+            raise SubgraphError(body["errors"])
+        return body.get("data") or {}
+
+
+subgraph_client = SubgraphClient()
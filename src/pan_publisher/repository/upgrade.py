@@ -0,0 +1,133 @@
+"""Bring a database created by an earlier release up to the current schema.
+
+``init_session`` creates missing tables, but it doesn't alter existing ones.
+Run this once after upgrading and before starting the new release:
+
+    python -m pan_publisher.repository.upgrade
+
+Every step is idempotent, so an interrupted upgrade can simply be re-run.
+"""
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex
+
+from pan_publisher.model.annotation import Annotation
+from pan_publisher.model.user import User
+from pan_publisher.repository.annotations import AnnotationsRepository
+from pan_publisher.repository.database import engine, init_session
+from pan_publisher.repository.ipfs import resolver as default_resolver
+
+BACKFILL_CHUNK_SIZE = 500
+
+SCHEMA_UPGRADES = (
+    # trigram operator classes of the substring filter index
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # replaced by ix_annotation_content_prefix, long content overflowed it
+    "DROP INDEX IF EXISTS ix_annotation_original_content_prefix",
+    # canonical content hash of submitted annotations
+    "ALTER TABLE annotation ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS annotation_content_hash_key "
+    "ON annotation (content_hash)",
+    # batch membership and Merkle inclusion proofs
+    "ALTER TABLE annotation ADD COLUMN IF NOT EXISTS batch_cid VARCHAR(50)",
+    "ALTER TABLE annotation ADD COLUMN IF NOT EXISTS batch_proof VARCHAR(66)[]",
+    # documents of deferred submissions that aren't on IPFS yet
+    "ALTER TABLE annotation ADD COLUMN IF NOT EXISTS pending_payload TEXT",
+    # keyed hash of auth tokens
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS token_hash VARCHAR(64)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS user_token_hash_key ON "user" (token_hash)',
+)
+
+
+def upgrade_schema(connection):
+    statements = [text(statement) for statement in SCHEMA_UPGRADES]
+    # built from the model, so they match the indexes of a fresh database
+    statements.extend(
+        CreateIndex(index, if_not_exists=True)
+        for index in sorted(Annotation.__table__.indexes, key=lambda i: i.name)
+    )
+    for statement in statements:
+        logger.info(f"Applying: {statement.compile(dialect=connection.dialect)}")
+        connection.execute(statement)
+
+
+def backfill_content_hashes(session, resolver=default_resolver):
+    """Fill content_hash of the rows stored before the column existed.
+
+    The hash covers the submitted document, which is exactly what the row's
+    CID points to on IPFS. Rows whose document can't be resolved, or whose
+    content is already stored under another CID, keep a NULL hash; they are
+    just not deduplicated.
+    """
+    repository = AnnotationsRepository(session, resolver=resolver)
+    filled = 0
+    last_id = None
+    while True:
+        query = (
+            session.query(Annotation.id, Annotation.subject_id)
+            .filter(Annotation.content_hash.is_(None))
+            .order_by(Annotation.id)
+        )
+        if last_id is not None:
+            # skip past rows that stay NULL instead of fetching them again
+            query = query.filter(Annotation.id > last_id)
+        rows = query.limit(BACKFILL_CHUNK_SIZE).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        results, _ = repository.resolve_cids([row.subject_id for row in rows])
+        documents = dict(results)
+        hashes = {}
+        for row in rows:
+            if row.subject_id in documents:
+                content_hash = Annotation.hash_content(documents[row.subject_id])
+                hashes.setdefault(content_hash, row.id)
+        known = repository.known_content_hashes(list(hashes))
+        for content_hash, row_id in hashes.items():
+            if content_hash in known:
+                continue
+            session.query(Annotation).filter(Annotation.id == row_id).update(
+                {Annotation.content_hash: content_hash}, synchronize_session=False
+            )
+            filled += 1
+        session.commit()
+    return filled
+
+
+def backfill_token_hashes(session):
+    """Fill token_hash of users whose token was issued before it existed.
+
+    Tokens are only looked up by their hash, so these users can't
+    authenticate until it is filled.
+    """
+    users = (
+        session.query(User)
+        .filter(User.token.isnot(None), User.token_hash.is_(None))
+        .all()
+    )
+    for user in users:
+        user.token_hash = User.hash_token(user.token)
+    session.commit()
+    return len(users)
+
+
+def upgrade():
+    # creates the tables that didn't exist before, e.g. the sync checkpoint
+    init_session()
+    with engine.begin() as connection:
+        upgrade_schema(connection)
+
+    session = sessionmaker(bind=engine)()
+    try:
+        filled = backfill_content_hashes(session)
+        logger.info(f"Backfilled the content hash of {filled} annotations")
+        filled = backfill_token_hashes(session)
+        logger.info(f"Backfilled the token hash of {filled} users")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    upgrade()
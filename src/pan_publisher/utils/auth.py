@@ -1,14 +1,22 @@
+import threading
+from collections import OrderedDict
+
 import bcrypt
 import shortuuid
 from cryptography.fernet import Fernet, InvalidToken
 
 
 class AuthManager:
-    def __init__(self, secret_key, token_charset, token_length):
+    def __init__(self, secret_key, token_charset, token_length, cache_size=0):
         self.secret_key = secret_key
         self.fernet_key = Fernet(secret_key)
         self.token_charset = token_charset
         self.token_length = token_length
+        # a token always decrypts to the same sid, so results can be kept for
+        # as long as the token is in use; revocation is checked by the caller
+        self.cache_size = cache_size
+        self._decrypted = OrderedDict()
+        self._lock = threading.Lock()
 
     def generate_session_id(self):
         return shortuuid.ShortUUID(alphabet=self.token_charset).random(
@@ -19,11 +27,23 @@ class AuthManager:
         return self.fernet_key.encrypt(data.encode("utf-8"))
 
     def decrypt(self, data):
+        with self._lock:
+            if data in self._decrypted:
+                self._decrypted.move_to_end(data)
+                return self._decrypted[data]
+
         try:
-            return self.fernet_key.decrypt(data.encode("utf-8"))
+            result = self.fernet_key.decrypt(data.encode("utf-8"))
         except InvalidToken:
             return None
 
+        if self.cache_size > 0:
+            with self._lock:
+                self._decrypted[data] = result
+                while len(self._decrypted) > self.cache_size:
+                    self._decrypted.popitem(last=False)
+        return result
+
     @staticmethod
     def hash_password(password):
         return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
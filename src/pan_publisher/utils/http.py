@@ -0,0 +1,114 @@
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from pan_publisher.config import HTTP_POLICIES
+
+# plain requests can't speak HTTP/2, so reuse comes from keep-alive pools
+_sessions = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _build_session(policy):
+    if policy["idempotent"]:
+        # IPFS adds and pins are keyed by content and subgraph queries only
+        # read, so their POSTs are safe to repeat
+        allowed_methods = False
+        read_retries = policy["retries"]
+    else:
+        # a POST that timed out or got an error status may still have been
+        # processed; only failed connection attempts are retried
+        allowed_methods = Retry.DEFAULT_ALLOWED_METHODS
+        read_retries = 0
+    retry = Retry(
+        total=policy["retries"],
+        connect=policy["retries"],
+        read=read_retries,
+        status=policy["retries"],
+        backoff_factor=policy["backoff"],
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=allowed_methods,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=policy["pool_size"],
+        pool_maxsize=policy["pool_size"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def http_session(dependency):
+    """Return the process-wide pooled session of an outbound dependency."""
+    with _lock:
+        if dependency not in _sessions:
+            _sessions[dependency] = _build_session(HTTP_POLICIES[dependency])
+        return _sessions[dependency]
+
+
+def async_http_client(dependency):
+    """Return the pooled httpx client of a dependency for the ASGI app.
+
+    httpx only retries failed connection attempts, so status retries are not
+    part of the async policy. HTTP/2 is used where the server offers it, so
+    concurrent requests share one connection.
+    """
+    if dependency not in _async_clients:
+        policy = HTTP_POLICIES[dependency]
+        # the client ignores its own pool settings when given a transport
+        transport = httpx.AsyncHTTPTransport(
+            # like the requests pools: keep pool_size connections alive, but
+            # don't make requests queue for one
+            limits=httpx.Limits(
+                max_connections=None,
+                max_keepalive_connections=policy["pool_size"],
+            ),
+            http2=True,
+            retries=policy["retries"],
+        )
+        _async_clients[dependency] = httpx.AsyncClient(
+            timeout=policy["timeout"], transport=transport
+        )
+    return _async_clients[dependency]
+
+
+async def close_async_http_clients():
+    while _async_clients:
+        _, client = _async_clients.popitem()
+        await client.aclose()
+
+
+def http_timeout(dependency):
+    return HTTP_POLICIES[dependency]["timeout"]
+
+
+def http_stats():
+    """Count requests and opened connections per dependency.
+
+    A connection count far below the request count means keep-alive reuse is
+    working. Counts of pools that urllib3 already evicted are not included.
+    """
+    stats = {}
+    with _lock:
+        sessions = dict(_sessions)
+    for dependency, session in sessions.items():
+        requests_sent = connections = 0
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        stats[dependency] = {
+            "requests": requests_sent,
+            "connections": connections,
+            "reused": max(0, requests_sent - connections),
+        }
+    return stats
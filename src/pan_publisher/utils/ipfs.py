@@ -0,0 +1,102 @@
+import hashlib
+
+# defaults of `ipfs add`: fixed-size 256KiB chunks in a balanced DAG of
+# dag-pb/UnixFS nodes with at most 174 links each, addressed by CIDv0
+CHUNK_SIZE = 262144
+MAX_LINKS = 174
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+UNIXFS_FILE = 2
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, wire_type, payload):
+    key = _varint(number << 3 | wire_type)
+    if wire_type == 0:
+        return key + _varint(payload)
+    return key + _varint(len(payload)) + payload
+
+
+def _base58(data):
+    number = int.from_bytes(data, "big")
+    out = ""
+    while number:
+        number, remainder = divmod(number, 58)
+        out = BASE58_ALPHABET[remainder] + out
+    padding = len(data) - len(data.lstrip(b"\0"))
+    return BASE58_ALPHABET[0] * padding + out
+
+
+def _unixfs_file(data=b"", filesize=0, blocksizes=()):
+    message = _field(1, 0, UNIXFS_FILE)
+    if data:
+        message += _field(2, 2, data)
+    message += _field(3, 0, filesize)
+    for blocksize in blocksizes:
+        message += _field(4, 0, blocksize)
+    return message
+
+
+def _pb_node(unixfs, links=()):
+    # canonical dag-pb encoding puts links before the data field
+    node = b""
+    for multihash, tsize in links:
+        link = _field(1, 2, multihash) + _field(2, 2, b"") + _field(3, 0, tsize)
+        node += _field(2, 2, link)
+    return node + _field(1, 2, unixfs)
+
+
+def _block(node):
+    return b"\x12\x20" + hashlib.sha256(node).digest(), len(node)
+
+
+# DAG nodes are passed around as (multihash, cumulative DAG size, file size)
+def _leaf(chunk):
+    node = _pb_node(_unixfs_file(chunk, len(chunk)))
+    multihash, size = _block(node)
+    return multihash, size, len(chunk)
+
+
+def _parent(children):
+    filesize = sum(child[2] for child in children)
+    node = _pb_node(
+        _unixfs_file(filesize=filesize, blocksizes=[child[2] for child in children]),
+        links=[(child[0], child[1]) for child in children],
+    )
+    multihash, size = _block(node)
+    return multihash, size + sum(child[1] for child in children), filesize
+
+
+def _balanced(leaves, depth):
+    if depth == 0:
+        return next(leaves, None)
+    children = []
+    while len(children) < MAX_LINKS:
+        child = _balanced(leaves, depth - 1)
+        if child is None:
+            break
+        children.append(child)
+    return _parent(children) if children else None
+
+
+def compute_cid(data: bytes) -> str:
+    """Compute the CIDv0 that `ipfs add` with default settings returns for data."""
+    chunks = [data[i : i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    if len(chunks) <= 1:
+        return _base58(_leaf(data)[0])
+
+    depth = 1
+    while MAX_LINKS ** depth < len(chunks):
+        depth += 1
+    root = _balanced(iter(_leaf(chunk) for chunk in chunks), depth)
+    return _base58(root[0])
@@ -0,0 +1,47 @@
+from eth_utils import keccak
+
+
+def _leaf(cid):
+    return keccak(text=cid)
+
+
+def _pair(a, b):
+    # sorted pairs let a proof be verified without left/right markers
+    return keccak(a + b) if a <= b else keccak(b + a)
+
+
+def merkle_tree(cids):
+    """Build the levels of a keccak256 Merkle tree over the given CIDs.
+
+    The first level holds the leaf hashes and the last one the root. A node
+    without a sibling is promoted to the next level unchanged.
+    """
+    levels = [[_leaf(cid) for cid in cids]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(levels):
+    return "0x" + levels[-1][0].hex()
+
+
+def merkle_proof(levels, index):
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append("0x" + level[sibling].hex())
+        index //= 2
+    return proof
+
+
+def verify_proof(cid, proof, root):
+    node = _leaf(cid)
+    for sibling in proof:
+        node = _pair(node, bytes.fromhex(sibling[2:]))
+    return "0x" + node.hex() == root
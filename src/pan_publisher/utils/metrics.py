@@ -0,0 +1,124 @@
+import os
+
+import redis
+from loguru import logger
+from prometheus_client import REGISTRY, CollectorRegistry, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+# spans sub-millisecond cache hits up to slow dependency round trips
+STAGE_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "pan_stage_seconds",
+    "Duration of a processing stage",
+    ["pipeline", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+
+
+def stage(pipeline, name):
+    """Time a block as a stage of a pipeline: ``with stage("submit", "signature")``"""
+    return STAGE_SECONDS.labels(pipeline, name).time()
+
+
+def observe(pipeline, name, seconds):
+    STAGE_SECONDS.labels(pipeline, name).observe(seconds)
+
+
+def _is_number(value):
+    # None marks an unknown value, which a gauge can't represent
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class RuntimeCollector:
+    """Reports point-in-time state on every scrape instead of tracking it.
+
+    ``engine`` is an SQLAlchemy engine with a QueuePool, ``broker_url`` the
+    Redis URL of the Celery broker and ``stats`` maps names to callables that
+    return a flat dict of numbers, like the caches' ``stats()``.
+    """
+
+    def __init__(self, engine=None, broker_url=None, queues=("celery",), stats=None):
+        self.engine = engine
+        self.broker = redis.Redis.from_url(broker_url) if broker_url else None
+        self.queues = queues
+        self.stats = stats or {}
+
+    def _pool(self):
+        pool = self.engine.pool
+        gauge = GaugeMetricFamily(
+            "pan_db_pool_connections", "Database pool connections", labels=["state"]
+        )
+        gauge.add_metric(["size"], pool.size())
+        gauge.add_metric(["checked_in"], pool.checkedin())
+        gauge.add_metric(["checked_out"], pool.checkedout())
+        gauge.add_metric(["overflow"], pool.overflow())
+        return gauge
+
+    def _queues(self):
+        gauge = GaugeMetricFamily(
+            "pan_celery_queue_length", "Tasks waiting in a queue", labels=["queue"]
+        )
+        for queue in self.queues:
+            gauge.add_metric([queue], self.broker.llen(queue))
+        return gauge
+
+    def _stats(self):
+        gauge = GaugeMetricFamily(
+            "pan_component_stat",
+            "Counters of internal components",
+            labels=["component", "stat"],
+        )
+        for component, stats in self.stats.items():
+            for stat, value in stats().items():
+                # one level of nesting, e.g. per-dependency HTTP counters
+                if isinstance(value, dict):
+                    for key, inner in value.items():
+                        if _is_number(inner):
+                            gauge.add_metric([component, f"{stat}.{key}"], inner)
+                elif _is_number(value):
+                    gauge.add_metric([component, stat], value)
+        return gauge
+
+    def collect(self):
+        if self.engine is not None:
+            yield self._pool()
+        if self.broker is not None:
+            try:
+                yield self._queues()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to read the Celery queue length: {e}")
+        if self.stats:
+            yield self._stats()
+
+
+def metrics_registry(*collectors):
+    """Return the registry to expose, with the given collectors attached.
+
+    With PROMETHEUS_MULTIPROC_DIR set, the metrics of all worker processes
+    are aggregated from that directory.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    for collector in collectors:
+        registry.register(collector)
+    return registry
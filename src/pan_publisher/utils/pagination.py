@@ -1,3 +1,26 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from uuid import UUID
+
+import falcon
+
+
+def encode_cursor(issuance_date, annotation_id):
+    raw = json.dumps([issuance_date.isoformat(), str(annotation_id)])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii"))
+        issuance_date, annotation_id = json.loads(raw)
+        return datetime.fromisoformat(issuance_date), UUID(annotation_id)
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise falcon.HTTPBadRequest(description="Invalid pagination cursor")
+
+
 class PaginationMiddleware:
     def _fetch_and_convert(self, req, name, default):
         value = req.params.get(name, default)
@@ -6,4 +29,12 @@ class PaginationMiddleware:
     def process_request(self, req, resp):
         offset = self._fetch_and_convert(req, name="offset", default=0)
         limit = self._fetch_and_convert(req, name="limit", default=10)
-        req.context.setdefault("pagination", {"offset": offset, "limit": limit})
+        cursor = req.params.get("cursor")
+        if cursor is not None:
+            cursor = decode_cursor(cursor)
+        req.context.setdefault(
+            "pagination", {"offset": offset, "limit": limit, "cursor": cursor}
+        )
+
+    async def process_request_async(self, req, resp):
+        self.process_request(req, resp)
@@ -0,0 +1,151 @@
+"""Opt-in cProfile sampling of API requests and Celery tasks.
+
+The sample rate starts at PROFILE_SAMPLE_RATE and can be changed on the fly,
+for all processes at once, through a Redis key:
+
+    python -m pan_publisher.utils.profiling 0.01     # profile 1% of the work
+    python -m pan_publisher.utils.profiling 0        # stop profiling
+    python -m pan_publisher.utils.profiling default  # back to the env setting
+
+Profiles are written as pstats files to PROFILE_DIR, e.g. for snakeviz or
+``python -m pstats``.
+"""
+import cProfile
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from secrets import compare_digest
+
+import redis
+from loguru import logger
+
+from pan_publisher.config import (
+    PROFILE_CONTROL_REDIS,
+    PROFILE_DIR,
+    PROFILE_MAX_FILES,
+    PROFILE_REFRESH,
+    PROFILE_SAMPLE_RATE,
+    PROFILE_TOKEN,
+)
+
+RATE_KEY = "pan:profiling:rate"
+
+
+class Sampler:
+    """Decides what to profile and writes the profiles.
+
+    The runtime rate is re-read from Redis at most every ``refresh`` seconds,
+    so the per-request cost of a disabled sampler is a clock read and a
+    comparison.
+    """
+
+    def __init__(
+        self,
+        directory=PROFILE_DIR,
+        rate=PROFILE_SAMPLE_RATE,
+        token=PROFILE_TOKEN,
+        redis_url=PROFILE_CONTROL_REDIS,
+        max_files=PROFILE_MAX_FILES,
+        refresh=PROFILE_REFRESH,
+    ):
+        self.directory = directory
+        self.default_rate = rate
+        self.rate = rate
+        self.token = token
+        self.redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self.max_files = max_files
+        self.refresh = refresh
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    def current_rate(self):
+        now = time.monotonic()
+        if self.redis is None or now - self._checked < self.refresh:
+            return self.rate
+        with self._lock:
+            self._checked = now
+            try:
+                value = self.redis.get(RATE_KEY)
+                self.rate = float(value) if value is not None else self.default_rate
+            except (redis.RedisError, ValueError) as e:
+                logger.warning(f"Failed to read the profiling rate: {e}")
+        return self.rate
+
+    def forced(self, value):
+        # forcing needs the configured token, so it can't be used to load
+        # the service with profiling
+        return bool(
+            self.token
+            and value
+            and compare_digest(value.encode("utf-8"), self.token.encode("utf-8"))
+        )
+
+    def sample(self):
+        rate = self.current_rate()
+        return rate > 0 and random.random() < rate
+
+    @staticmethod
+    def start():
+        """Return an enabled profiler, or None if one is already running."""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            return None
+        return profiler
+
+    def finish(self, profiler, kind, name, duration):
+        """Stop ``profiler`` and write its stats; returns the file name."""
+        profiler.disable()
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")
+        filename = (
+            f"{kind}-{safe_name}-{int(time.time() * 1000)}-{os.getpid()}"
+            f"-{next(self._sequence)}-{duration * 1000:.0f}ms.prof"
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.directory, filename))
+        except OSError as e:
+            logger.warning(f"Failed to write profile {filename}: {e}")
+            return None
+        self._prune()
+        return filename
+
+    def _prune(self):
+        # other processes prune the same directory, files may vanish anytime
+        try:
+            entries = [
+                (entry.stat().st_mtime, entry.path)
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(".prof")
+            ]
+            entries.sort()
+            for _, path in entries[: max(0, len(entries) - self.max_files)]:
+                os.remove(path)
+        except OSError as e:
+            logger.debug(f"Profile pruning skipped: {e}")
+
+
+sampler = Sampler()
+
+
+def set_rate(value):
+    """Set the runtime sample rate of all processes, None for the default."""
+    if sampler.redis is None:
+        raise RuntimeError("PROFILE_CONTROL_REDIS is not configured")
+    if value is None:
+        sampler.redis.delete(RATE_KEY)
+    else:
+        sampler.redis.set(RATE_KEY, float(value))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    set_rate(None if sys.argv[1] == "default" else float(sys.argv[1]))
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+
+import redis
+from eth_account import Account
+from eth_account.messages import encode_defunct
+from eth_utils import keccak, remove_0x_prefix
+from loguru import logger
+
+from pan_publisher.config import (
+    BULK_VERIFY_WORKERS,
+    SIGNATURE_CACHE_REDIS,
+    SIGNATURE_CACHE_SIZE,
+    SIGNATURE_CACHE_TTL,
+)
+
+try:
+    from coincurve import PublicKey
+except ImportError:
+    PublicKey = None
+
+# below this many signatures, shipping them to the pool costs more than it saves
+POOL_THRESHOLD = 32
+
+_pool = None
+
+
+class SignatureCache:
+    """Memoizes recovered signers of byte-identical (message, jws) pairs.
+
+    Entries live in a bounded in-process LRU with a TTL and, if a Redis URL is
+    configured, in Redis so that all gunicorn workers share them.
+    """
+
+    def __init__(
+        self,
+        redis_url=SIGNATURE_CACHE_REDIS,
+        size=SIGNATURE_CACHE_SIZE,
+        ttl=SIGNATURE_CACHE_TTL,
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self.hits = 0
+        self.misses = 0
+        self.recoveries = 0
+        self.recovery_time = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, jws):
+        digest = hashlib.sha256(text.encode("utf-8") + b"\0" + jws.encode("utf-8"))
+        return "pan:signature:" + digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        issuer = None
+        if self.redis is not None:
+            try:
+                issuer = self.redis.get(key)
+            except redis.RedisError as e:
+                logger.warning(f"Signature cache lookup failed: {e}")
+
+        with self._lock:
+            if issuer is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        issuer = issuer.decode("utf-8")
+        self._remember(key, issuer)
+        return issuer
+
+    def _remember(self, key, issuer):
+        with self._lock:
+            self._entries[key] = (issuer, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def set(self, key, issuer, duration):
+        with self._lock:
+            self.recoveries += 1
+            self.recovery_time += duration
+        self._remember(key, issuer)
+        if self.redis is not None:
+            try:
+                self.redis.set(key, issuer, ex=self.ttl)
+            except redis.RedisError as e:
+                logger.warning(f"Signature cache update failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            average = self.recovery_time / self.recoveries if self.recoveries else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                # every hit skips one recovery of average duration
+                "time_saved": self.hits * average,
+            }
+
+
+signature_cache = SignatureCache()
+
+
+def signed_message(document):
+    message = deepcopy(document)
+    del message["proof"]["jws"]
+    return json.dumps(message, separators=(",", ":"))
+
+
+def _recover_coincurve(text, raw_signature):
+    data = text.encode("utf-8")
+    message_hash = keccak(
+        b"\x19Ethereum Signed Message:\n" + str(len(data)).encode("utf-8") + data
+    )
+    signature = bytes.fromhex(raw_signature[:128]) + bytes(
+        [int(raw_signature[128:130], 16) - 27]
+    )
+    public_key = PublicKey.from_signature_and_message(
+        signature, message_hash, hasher=None
+    )
+    return "0x" + keccak(public_key.format(compressed=False)[1:])[-20:].hex()
+
+
+def _recover(text, raw_signature):
+    if PublicKey is not None:
+        return _recover_coincurve(text, raw_signature)
+    return Account.recover_message(
+        signable_message=encode_defunct(text=text),
+        vrs=(
+            int(raw_signature[128:130], 16),  # 0x1c or bust
+            int(raw_signature[0:64], 16),
+            int(raw_signature[64:128], 16),
+        ),
+    )
+
+
+def _recover_timed(text, jws):
+    start_time = time.perf_counter()
+    issuer = _recover(text, remove_0x_prefix(jws))
+    return issuer, time.perf_counter() - start_time
+
+
+def _recover_cached(text, jws):
+    key = SignatureCache.key(text, jws)
+    issuer = signature_cache.get(key)
+    if issuer is None:
+        issuer, duration = _recover_timed(text, jws)
+        signature_cache.set(key, issuer, duration)
+    return issuer
+
+
+def recover_issuer(document):
+    """Recover the address that signed an annotation's proof JWS."""
+    return _recover_cached(signed_message(document), document["proof"]["jws"])
+
+
+def recover_batch_issuer(batch):
+    """Recover the address that signed a publisher's batch credential."""
+    message = deepcopy(batch)
+    del message["proof"]["jws"]
+    text = json.dumps(message, sort_keys=True, separators=(",", ":"))
+    return _recover_cached(text, batch["proof"]["jws"])
+
+
+def _recover_safe(text, jws):
+    try:
+        return _recover_timed(text, jws)
+    except Exception:
+        return None, 0.0
+
+
+def recover_issuers(documents):
+    """Recover the signers of many annotations, None where recovery failed.
+
+    Cached signers are answered directly. The remaining large inputs are
+    spread across a process pool so that throughput scales with the number
+    of cores.
+    """
+    global _pool
+    issuers = [None] * len(documents)
+    pending = []
+    for index, document in enumerate(documents):
+        try:
+            text = signed_message(document)
+            jws = document["proof"]["jws"]
+        except (KeyError, TypeError):
+            continue
+        key = SignatureCache.key(text, jws)
+        issuers[index] = signature_cache.get(key)
+        if issuers[index] is None:
+            pending.append((index, key, text, jws))
+
+    texts = [text for _, _, text, _ in pending]
+    signatures = [jws for _, _, _, jws in pending]
+    if len(pending) < POOL_THRESHOLD or BULK_VERIFY_WORKERS <= 1:
+        recovered = map(_recover_safe, texts, signatures)
+    else:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=BULK_VERIFY_WORKERS)
+        chunksize = max(1, len(pending) // (BULK_VERIFY_WORKERS * 4))
+        recovered = _pool.map(_recover_safe, texts, signatures, chunksize=chunksize)
+
+    for (index, key, _, _), (issuer, duration) in zip(pending, recovered):
+        if issuer is not None:
+            signature_cache.set(key, issuer, duration)
+        issuers[index] = issuer
+    return issuers
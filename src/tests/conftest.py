@@ -0,0 +1,22 @@
+import os
+
+# pan_publisher.config validates these on import
+for name, value in {
+    "SECRET_KEY": "test",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_DB": "test",
+    "PINATA_API_KEY": "test",
+    "PINATA_SECRET_API_KEY": "test",
+    "PINATA_ENDPOINT": "http://localhost/pinning/pinByHash",
+    "PUBLISHER_PRIVATE_KEY": "0x" + "11" * 32,
+    "REGISTRY_CONTRACT": "0x715c754BF2019FFF238B8E4781eB2D4032408B44",
+    "INFURA_URL": "http://localhost:8545",
+    "CELERY_BROKER": "redis://localhost:6379/15",
+    "CELERY_BACKEND": "redis://localhost:6379/15",
+    "BEAT_BROKER": "redis://localhost:6379/15",
+    "BEAT_BACKEND": "redis://localhost:6379/15",
+    "THEGRAPH_IPFS_ENDPOINT": "http://localhost/api/v0/add",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,37 @@
+import hashlib
+
+from pan_publisher.utils.ipfs import CHUNK_SIZE, _base58, compute_cid
+
+
+def _multihash(node):
+    return b"\x12\x20" + hashlib.sha256(node).digest()
+
+
+def test_compute_cid_matches_ipfs_add():
+    # what `ipfs add` returns for these files
+    assert compute_cid(b"hello world\n") == (
+        "QmT78zSuBmuS4z925WZfrqQ1qHaJ56DQaTfyMUF7F8ff5o"
+    )
+    assert compute_cid(b"") == "QmbFMke1KXqnYyBBWxB74N4c5SBnJMVAiMNRcGu6x1AwQH"
+
+
+def test_compute_cid_of_multiple_chunks():
+    data = b"a" * (CHUNK_SIZE + 1)
+
+    # the two leaves and their root, encoded by hand: UnixFS file data
+    # (type, data, filesize) wrapped in a dag-pb node
+    first = b"\x0a\x8a\x80\x10" + (
+        b"\x08\x02\x12\x80\x80\x10" + data[:CHUNK_SIZE] + b"\x18\x80\x80\x10"
+    )
+    second = b"\x0a\x07" + b"\x08\x02\x12\x01a\x18\x01"
+    # links (hash, empty name, cumulative size) come before the data, which
+    # holds the file size and one block size per link
+    root = (
+        b"\x12\x2a\x0a\x22" + _multihash(first) + b"\x12\x00\x18\x8e\x80\x10"
+        b"\x12\x28\x0a\x22" + _multihash(second) + b"\x12\x00\x18\x09"
+        b"\x0a\x0c\x08\x02\x18\x81\x80\x10\x20\x80\x80\x10\x20\x01"
+    )
+    assert len(first) == 262158
+
+    assert compute_cid(data) == _base58(_multihash(root))
+    assert compute_cid(data) == "QmTaxvXcxpzzaatSEEAYr7t3knkJ6DmTVbr8MjJJWLRWpV"
@@ -0,0 +1,35 @@
+import pytest
+
+from pan_publisher.utils.merkle import (
+    merkle_proof,
+    merkle_root,
+    merkle_tree,
+    verify_proof,
+)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 6, 7, 9])
+def test_proofs_verify_for_every_leaf(size):
+    cids = [f"Qm{index:044d}" for index in range(size)]
+    levels = merkle_tree(cids)
+    root = merkle_root(levels)
+
+    for index, cid in enumerate(cids):
+        proof = merkle_proof(levels, index)
+        assert verify_proof(cid, proof, root)
+        assert not verify_proof("QmUnknown", proof, root)
+
+
+def test_promoted_leaf_has_a_shorter_proof():
+    levels = merkle_tree(["QmA", "QmB", "QmC"])
+
+    assert len(merkle_proof(levels, 0)) == 2
+    # the third leaf has no sibling on the first level
+    assert len(merkle_proof(levels, 2)) == 1
+
+
+def test_proof_does_not_verify_against_another_root():
+    levels = merkle_tree(["QmA", "QmB", "QmC"])
+    other = merkle_root(merkle_tree(["QmA", "QmB", "QmD"]))
+
+    assert not verify_proof("QmA", merkle_proof(levels, 0), other)
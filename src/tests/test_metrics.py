@@ -0,0 +1,27 @@
+from prometheus_client import generate_latest
+
+from pan_publisher.repository.cache import DocumentCache, ResponseCache
+from pan_publisher.utils.metrics import RuntimeCollector, metrics_registry
+
+
+def test_scrape_with_default_caches():
+    # no disk tier and no Redis, like the default configuration
+    document_cache = DocumentCache(directory=None)
+    response_cache = ResponseCache(redis_url=None)
+    collector = RuntimeCollector(
+        stats={
+            "document_cache": document_cache.stats,
+            "response_cache": response_cache.stats,
+            "http": lambda: {"thegraph": {"requests": 3, "unknown": None}},
+        }
+    )
+    registry = metrics_registry(collector)
+    try:
+        output = generate_latest(registry).decode("utf-8")
+    finally:
+        registry.unregister(collector)
+
+    assert 'pan_component_stat{component="document_cache",stat="hits"} 0.0' in output
+    assert 'stat="disk_bytes"' not in output
+    assert 'stat="thegraph.requests"} 3.0' in output
+    assert "thegraph.unknown" not in output